@@ -0,0 +1,81 @@
+"""Cold start of the AppCache with generated apps, then the cost of
+get_document/get_documents/get_app_label once it is populated. With
+``lazy`` set to 1, EXTRAS_MONGOENGINE_LAZY_APPS is enabled and the first
+lookup of a single document is timed instead of the full population.
+
+Doesn't need a running mongod::
+
+    python benchmarks/bench_app_cache.py [apps] [documents_per_app] [lookups] [lazy]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+
+DOCUMENT_TEMPLATE = '''
+class Document%(n)d(Document):
+    name = StringField()
+    meta = {'collection': '%(app)s_document%(n)d'}
+'''
+
+
+def make_apps(path, apps, documents):
+    names = []
+    for i in range(apps):
+        name = 'benchapp%d' % i
+        os.mkdir(os.path.join(path, name))
+        open(os.path.join(path, name, '__init__.py'), 'w').close()
+        with open(os.path.join(path, name, 'models.py'), 'w') as f:
+            f.write('from mongoengine import Document, StringField\n')
+            for n in range(documents):
+                f.write(DOCUMENT_TEMPLATE % {'n': n, 'app': name})
+        names.append(name)
+    return names
+
+
+def main(apps=200, documents=5, lookups=100000, lazy=0):
+    path = tempfile.mkdtemp()
+    try:
+        names = make_apps(path, apps, documents)
+        sys.path.insert(0, path)
+
+        from django.conf import settings
+        settings.configure(INSTALLED_APPS=names,
+                           EXTRAS_MONGOENGINE_LAZY_APPS=bool(lazy))
+        from extras_mongoengine import utils
+
+        start = time.time()
+        if lazy:
+            utils.get_document('benchapp%d' % (apps // 2), 'document0')
+            print('lazy get_document with %d apps: %8.3f s'
+                  % (apps, time.time() - start))
+            start = time.time()
+        utils.cache._populate()
+        print('populate %d apps x %d documents: %8.3f s'
+              % (apps, documents, time.time() - start))
+
+        document = utils.get_document('benchapp0', 'document0')
+        elapsed = timeit.timeit(
+            lambda: utils.get_document('benchapp%d' % (apps - 1), 'Document0'),
+            number=lookups)
+        print('get_document    x %d: %8.3f s' % (lookups, elapsed))
+        elapsed = timeit.timeit(lambda: utils.get_app_label(document),
+                                number=lookups)
+        print('get_app_label   x %d: %8.3f s' % (lookups, elapsed))
+        elapsed = timeit.timeit(utils.get_documents, number=lookups // 100)
+        print('get_documents() x %d: %8.3f s' % (lookups // 100, elapsed))
+        utils.cache.set_available_apps(names[:apps // 2])
+        elapsed = timeit.timeit(utils.get_documents, number=lookups // 100)
+        print('get_documents() with available apps x %d: %8.3f s'
+              % (lookups // 100, elapsed))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+"""Load time of documents with several TimedeltaField/EnumField values,
+eager against ``lazy=True``, reading one field per document.
+
+Requires a running mongod on localhost::
+
+    python benchmarks/bench_lazy_load.py [documents]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+from enum import Enum
+
+from mongoengine import Document, connect
+from mongoengine.connection import get_db
+
+from extras_mongoengine.fields import TimedeltaField, IntEnumField, StringEnumField
+
+
+class Status(Enum):
+    PENDING = 'PENDING'
+    DONE = 'DONE'
+
+
+class Priority(Enum):
+    LOW = 1
+    HIGH = 2
+
+
+def make_document(lazy):
+    class BenchTask(Document):
+        wait = TimedeltaField(lazy=lazy)
+        run = TimedeltaField(lazy=lazy)
+        total = TimedeltaField(lazy=lazy)
+        status = StringEnumField(Status, lazy=lazy)
+        priority = IntEnumField(Priority, lazy=lazy)
+
+        meta = {'collection': 'bench_lazy_load'}
+    return BenchTask
+
+
+def main(documents=100000):
+    connect(db='extrasmongoenginebench')
+    collection = make_document(False)._get_collection()
+    collection.drop()
+    collection.insert([{'wait': i % 600, 'run': i % 60, 'total': i % 660,
+                        'status': 'DONE' if i % 2 else 'PENDING',
+                        'priority': 1 + i % 2}
+                       for i in range(documents)])
+
+    for lazy in (False, True):
+        document = make_document(lazy)
+        elapsed = timeit.timeit(
+            lambda: [task.status for task in document.objects], number=1)
+        print('lazy=%-5s %d documents: %8.2f s' % (lazy, documents, elapsed))
+    get_db().connection.drop_database('extrasmongoenginebench')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
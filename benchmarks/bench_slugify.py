@@ -0,0 +1,60 @@
+# coding: utf-8
+"""Throughput of plain ``python-slugify`` against :class:`CachedSlugifier`
+on a repetitive multilingual corpus (category names and tags)::
+
+    python benchmarks/bench_slugify.py [inputs] [distinct]
+"""
+from __future__ import print_function, unicode_literals
+
+import random
+import sys
+import timeit
+
+from slugify import slugify
+
+from extras_mongoengine.fields import CachedSlugifier
+
+
+WORDS = [
+    'Hello World', 'Breaking News', 'Ünïcödé Straße', 'Größenordnung',
+    'Привет мир', 'Новости спорта', 'Καλημέρα κόσμε', 'Ελληνική κουζίνα',
+    '北京烤鸭', '你好世界', 'こんにちは世界', 'Ça va très bien',
+    'Crème brûlée', 'Zażółć gęślą jaźń', 'Příliš žluťoučký kůň',
+]
+
+
+def corpus(size, distinct):
+    rng = random.Random(42)
+    titles = ['%s %s' % (rng.choice(WORDS), i) for i in range(distinct)]
+    # Zipf-like: a few titles make up most of the inputs.
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    total = sum(weights)
+    cumulative = []
+    acc = 0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    inputs = []
+    for _ in range(size):
+        r = rng.random()
+        inputs.append(titles[next(i for i, c in enumerate(cumulative) if c >= r)])
+    return inputs
+
+
+def run(func, inputs):
+    for value in inputs:
+        func(value)
+
+
+def main(size=20000, distinct=500):
+    inputs = corpus(size, distinct)
+    cached = CachedSlugifier(slugify, maxsize=256)
+    for name, func in (('slugify', slugify), ('cached', cached)):
+        elapsed = timeit.timeit(lambda: run(func, inputs), number=1)
+        print('%-8s %10.0f slugs/s' % (name, size / elapsed))
+    print('cache    %(hits)d hits, %(misses)d misses, %(currsize)d/%(maxsize)d entries'
+          % cached.cache.info())
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
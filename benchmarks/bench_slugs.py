@@ -0,0 +1,51 @@
+"""Save latency of :class:`AutoSlugField` against a collection that already
+holds thousands of documents sharing the same base slug.
+
+Requires a running mongod on localhost::
+
+    python benchmarks/bench_slugs.py [collisions] [saves]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from mongoengine import Document, StringField, connect
+from mongoengine.connection import get_db
+
+from extras_mongoengine.fields import AutoSlugField, SlugCounter
+
+
+def make_document(strategy):
+    class BenchArticle(Document):
+        title = StringField()
+        slug = AutoSlugField(populate_from='title', slug_strategy=strategy)
+
+        meta = {'collection': 'bench_slugs_%s' % strategy}
+    return BenchArticle
+
+
+def seed(document, collisions):
+    document.drop_collection()
+    document.ensure_indexes()
+    document._get_collection().insert(
+        [{'title': 'Untitled', 'slug': 'untitled'}] +
+        [{'title': 'Untitled', 'slug': 'untitled-%s' % i}
+         for i in range(1, collisions)])
+
+
+def main(collisions=2000, saves=20):
+    connect(db='extrasmongoenginebench')
+    for strategy in AutoSlugField.SLUG_STRATEGIES:
+        document = make_document(strategy)
+        seed(document, collisions)
+        SlugCounter.drop_collection()
+        elapsed = timeit.timeit(
+            lambda: document(title='Untitled').save(), number=saves)
+        print('%-8s %6d collisions: %8.2f ms/save' % (
+            strategy, collisions, elapsed / saves * 1000))
+    get_db().connection.drop_database('extrasmongoenginebench')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,512 @@
+"""
+Pluggable backends for the process-wide caches of the contrib apps
+(``SITE_CACHE`` and the ContentType cache).
+
+A :class:`CacheNamespace` is a dict-like view of a backend. Its keys are
+scoped by a generation number: clearing a namespace bumps the generation
+instead of deleting entries. When a ``check_interval`` is configured the
+generation is stored in MongoDB (see :class:`CacheGeneration`) and
+re-read at most every ``check_interval`` seconds, so every process notices
+an invalidation with a single small read instead of re-polling the cached
+collection.
+
+Namespaces are configured with the ``EXTRAS_MONGOENGINE_CACHES`` setting::
+
+    EXTRAS_MONGOENGINE_CACHES = {
+        'sites': {
+            'BACKEND': 'extras_mongoengine.cache.SharedFileBackend',
+            'OPTIONS': {'path': '/run/myproject/sites.cache'},
+            'CHECK_INTERVAL': 1.0,
+        },
+    }
+
+``CHECK_INTERVAL`` defaults to one second for the shared backends and to
+``None`` (no generation in MongoDB) for :class:`LocalMemoryBackend`, which
+is also the backend of namespaces that aren't configured.
+
+With ``'BROADCAST': True`` invalidated keys are also published to a capped
+collection; :func:`start_invalidation_watcher` starts a thread tailing it
+and evicting the keys from the local caches of the process as soon as the
+write that invalidated them has succeeded.
+"""
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from hashlib import md5
+
+from mongoengine import Document
+from mongoengine.fields import DynamicField, IntField, StringField
+from pymongo import CursorType
+from pymongo.errors import PyMongoError
+
+
+__all__ = ('LocalMemoryBackend', 'SharedFileBackend', 'DjangoCacheBackend',
+    'CacheGeneration', 'CacheInvalidation', 'CacheNamespace',
+    'InvalidationWatcher', 'start_invalidation_watcher')
+
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+# Every CacheNamespace of the process, for the InvalidationWatcher.
+_namespaces = weakref.WeakSet()
+
+
+class LocalMemoryBackend(object):
+    """Keeps entries in a dict of the current process."""
+
+    shared = False
+    clearable = True
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def set_many(self, mapping):
+        with self._lock:
+            self._data.update(mapping)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedFileBackend(object):
+    """
+    Shares entries between the processes of a host through a pickled dict
+    in a memory-mapped file. Readers only reload the file when it has been
+    replaced; writers hold an exclusive lock on ``path + '.lock'``, merge
+    their change and atomically replace the file. Each write also drops the
+    entries of older generations of the namespaces it writes to, so that
+    clearing a namespace doesn't leave dead entries in the file.
+    """
+
+    shared = True
+    clearable = True
+
+    def __init__(self, path):
+        self.path = path
+        self._data = {}
+        self._stamp = None
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._data, self._stamp = {}, None
+            return self._data
+        stamp = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if stamp != self._stamp:
+            self._data = self._read() if stat.st_size else {}
+            self._stamp = stamp
+        return self._data
+
+    def _read(self):
+        import mmap
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return pickle.load(mapped)
+            finally:
+                mapped.close()
+
+    @staticmethod
+    def _prune(data, keys):
+        """Removes the entries of generations older than the ones of
+        ``keys``, which are ``(namespace, generation, key)`` tuples."""
+        generations = {}
+        for key in keys:
+            if isinstance(key, tuple) and len(key) == 3:
+                generations[key[0]] = max(key[1], generations.get(key[0], key[1]))
+        if not generations:
+            return
+        for key in list(data):
+            if (isinstance(key, tuple) and len(key) == 3
+                    and key[1] < generations.get(key[0], key[1])):
+                del data[key]
+
+    @contextmanager
+    def _update(self, keys=()):
+        import fcntl
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = dict(self._load())
+                yield data
+                self._prune(data, keys)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.')
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def set(self, key, value):
+        with self._update([key]) as data:
+            data[key] = value
+
+    def set_many(self, mapping):
+        """Stores every entry of ``mapping`` with a single rewrite."""
+        with self._update(list(mapping)) as data:
+            data.update(mapping)
+
+    def delete(self, key):
+        with self._update([key]) as data:
+            data.pop(key, None)
+
+    def clear(self):
+        with self._update() as data:
+            data.clear()
+
+
+class DjangoCacheBackend(object):
+    """Stores entries in one of the caches of Django's cache framework."""
+
+    shared = True
+    # Can't clear only the entries of a namespace, generations must be used.
+    clearable = False
+
+    def __init__(self, alias='default', timeout=None, key_prefix='extras_mongoengine'):
+        try:
+            from django.core.cache import caches
+            self._cache = caches[alias]
+        except ImportError:
+            # Django < 1.7
+            from django.core.cache import get_cache
+            self._cache = get_cache(alias)
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def _make_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        raw = u':'.join(u'%s' % (part,) for part in key)
+        return '%s:%s' % (self.key_prefix, md5(raw.encode('utf-8')).hexdigest())
+
+    def get(self, key, default=None):
+        return self._cache.get(self._make_key(key), default)
+
+    def set(self, key, value):
+        self._cache.set(self._make_key(key), value, self.timeout)
+
+    def set_many(self, mapping):
+        self._cache.set_many(
+            dict((self._make_key(key), value) for key, value in mapping.items()),
+            self.timeout)
+
+    def delete(self, key):
+        self._cache.delete(self._make_key(key))
+
+    def clear(self):
+        # Entries of older generations are simply never read again, so this
+        # backend needs a CHECK_INTERVAL (see CacheNamespace).
+        pass
+
+
+class CacheGeneration(Document):
+    """The current generation of a :class:`CacheNamespace`."""
+    id = StringField(primary_key=True)
+    generation = IntField(default=0)
+
+    meta = {
+        'collection': 'extras_mongoengine_cache_generations',
+    }
+
+    @classmethod
+    def current(cls, name):
+        generation = cls.objects(id=name).first()
+        return generation.generation if generation else 0
+
+    @classmethod
+    def bump(cls, name):
+        return cls.objects(id=name).modify(
+            upsert=True, new=True, inc__generation=1).generation
+
+
+def _encode_key(key):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def _decode_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+class CacheInvalidation(Document):
+    """A capped log of the keys invalidated in broadcast namespaces."""
+    namespace = StringField()
+    keys = DynamicField()
+
+    meta = {
+        'collection': 'extras_mongoengine_cache_invalidations',
+        'max_documents': 10000,
+        'max_size': 2 * 1024 * 1024,
+    }
+
+    @classmethod
+    def publish(cls, namespace, keys):
+        cls._get_collection().insert_one({
+            'namespace': namespace,
+            'keys': [_encode_key(key) for key in keys],
+        })
+
+
+class InvalidationWatcher(threading.Thread):
+    """
+    Tails the :class:`CacheInvalidation` collection with a tailable cursor
+    and evicts the published keys from the namespaces of this process.
+    Events published before the watcher started are skipped.
+    """
+
+    def __init__(self, retry_interval=1.0):
+        super(InvalidationWatcher, self).__init__(
+            name='extras_mongoengine cache invalidation watcher')
+        self.daemon = True
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+        self._collection = CacheInvalidation._get_collection()
+        last = self._collection.find_one(sort=[('$natural', -1)])
+        self._last_id = last['_id'] if last else None
+
+    def _apply(self, event):
+        self._last_id = event['_id']
+        keys = [_decode_key(key) for key in event.get('keys', [])]
+        for namespace in list(_namespaces):
+            if namespace.name == event.get('namespace'):
+                namespace.evict(*keys)
+
+    def _apply_unseen(self, events):
+        """
+        Applies the events following the last one applied, ``events`` being
+        every event of the collection in ``$natural`` (insertion) order.
+        ObjectIds of different processes aren't ordered by insertion, so the
+        position of the last event is used rather than ``_id > last``. If
+        that event has been dropped by the capped collection meanwhile,
+        every event is applied: evicting too much is harmless. Returns how
+        many events were applied.
+        """
+        last_id = self._last_id
+        skipped = [] if last_id is not None else None
+        count = 0
+        for event in events:
+            if skipped is not None:
+                if event['_id'] == last_id:
+                    skipped = None
+                else:
+                    skipped.append(event)
+                continue
+            self._apply(event)
+            count += 1
+        for event in skipped or ():
+            self._apply(event)
+            count += 1
+        return count
+
+    def poll(self):
+        """Applies the events published since the last one seen and returns
+        how many there were."""
+        return self._apply_unseen(self._collection.find().sort('$natural', 1))
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                cursor = self._collection.find(
+                    cursor_type=CursorType.TAILABLE_AWAIT)
+                # The first batch starts at the beginning of the collection.
+                self._apply_unseen(cursor)
+                while cursor.alive and not self._stopped.is_set():
+                    for event in cursor:
+                        self._apply(event)
+            except PyMongoError:
+                pass
+            except Exception:
+                # Invalidation must go on, e.g. after a malformed event or an
+                # error of a backend.
+                logger.exception('Cache invalidation watcher failed, '
+                                 'retrying in %s s', self.retry_interval)
+            self._stopped.wait(self.retry_interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def start_invalidation_watcher():
+    """Starts the :class:`InvalidationWatcher` of the process, once."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = InvalidationWatcher()
+            _watcher.start()
+    return _watcher
+
+
+def _import_string(path):
+    module_name, _, attr = path.rpartition('.')
+    module = __import__(module_name, fromlist=[attr])
+    return getattr(module, attr)
+
+
+def _get_config(name):
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+    except ImportError:
+        caches = {}
+    else:
+        try:
+            caches = getattr(settings, 'EXTRAS_MONGOENGINE_CACHES', {})
+        except ImproperlyConfigured:
+            caches = {}
+    config = caches.get(name.split(':', 1)[0], {})
+    backend = config.get('BACKEND')
+    if backend is None:
+        backend = LocalMemoryBackend()
+    else:
+        backend = _import_string(backend)(**config.get('OPTIONS', {}))
+    check_interval = config.get('CHECK_INTERVAL', 1.0 if backend.shared else None)
+    if check_interval is None and not getattr(backend, 'clearable', True):
+        raise ImproperlyConfigured(
+            "The %r cache of EXTRAS_MONGOENGINE_CACHES needs a CHECK_INTERVAL: "
+            "its backend can't be cleared." % name.split(':', 1)[0])
+    return backend, check_interval, config.get('BROADCAST', False)
+
+
+class CacheNamespace(object):
+    """
+    A dict-like, generation-scoped view of a cache backend.
+
+    :param name: the namespace name. Settings are looked up by the part
+        before the first ``':'``, so ``'contenttypes:default'`` is configured
+        by the ``'contenttypes'`` entry.
+    :param backend: the backend; read from ``EXTRAS_MONGOENGINE_CACHES``
+        on first use when omitted.
+    :param check_interval: seconds between two reads of the generation
+        stored in MongoDB; with ``None`` no generation is used and clearing
+        the namespace clears the backend.
+    :param broadcast: publish invalidated keys to the
+        :class:`CacheInvalidation` collection, from which the
+        :class:`InvalidationWatcher` of every process evicts them.
+    """
+
+    def __init__(self, name, backend=None, check_interval=None, broadcast=False):
+        if (backend is not None and check_interval is None
+                and not getattr(backend, 'clearable', True)):
+            raise ValueError("%s can't be cleared, a check_interval is needed"
+                             % backend.__class__.__name__)
+        self.name = name
+        self._backend = backend
+        self.check_interval = check_interval
+        self.broadcast = broadcast
+        self._generation = 0
+        self._checked = 0
+        self._lock = threading.Lock()
+        _namespaces.add(self)
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    (self._backend, self.check_interval,
+                     self.broadcast) = _get_config(self.name)
+        return self._backend
+
+    def _key(self, key):
+        backend = self.backend
+        if self.check_interval is not None:
+            now = time.time()
+            if now - self._checked >= self.check_interval:
+                self._checked = now
+                generation = CacheGeneration.current(self.name)
+                if generation != self._generation:
+                    self._generation = generation
+                    if not backend.shared:
+                        backend.clear()
+        return (self.name, self._generation, key)
+
+    def get(self, key, default=None):
+        return self.backend.get(self._key(key), default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __setitem__(self, key, value):
+        self.backend.set(self._key(key), value)
+
+    def set_many(self, mapping):
+        """Stores every entry of ``mapping`` at once, e.g. to warm the
+        cache up."""
+        self.backend.set_many(
+            dict((self._key(key), value) for key, value in mapping.items()))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.backend.delete(self._key(key))
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self.backend.delete(self._key(key))
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Removes ``keys``, in every process if the namespace is shared,
+        broadcast or uses a generation. Without broadcasting, a generation is
+        the only way to reach the local backends of other processes, so the
+        whole namespace is cleared.
+        """
+        backend = self.backend
+        if backend.shared or self.check_interval is None or self.broadcast:
+            for key in keys:
+                self.pop(key)
+        else:
+            self.clear()
+        if self.broadcast and not backend.shared:
+            CacheInvalidation.publish(self.name, keys)
+
+    def evict(self, *keys):
+        """Removes ``keys`` from this process only."""
+        backend = self.backend
+        if not backend.shared:
+            for key in keys:
+                backend.delete(self._key(key))
+
+    def clear(self):
+        backend = self.backend
+        if self.check_interval is None:
+            backend.clear()
+            return
+        self._generation = CacheGeneration.bump(self.name)
+        self._checked = time.time()
+        if not backend.shared:
+            backend.clear()
@@ -0,0 +1,172 @@
+#from django.contrib.contenttypes.models import ContentType
+#from django.db import DEFAULT_DB_ALIAS, router
+#from django.db.models import get_apps, get_model, get_models, signals, UnavailableApp
+import threading
+from hashlib import sha1
+
+from django.utils.six.moves import input
+
+from extras_mongoengine.contrib.contenttypes.models import ContentType
+from extras_mongoengine.utils import get_apps, get_documents, get_app_label
+from mongoengine.base import get_document
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_db
+from mongoengine.errors import NotRegistered
+from pymongo import DeleteMany, UpdateOne
+
+
+def _confirm_removal(to_remove):
+    content_type_display = '\n'.join([
+        '    %s | %s' % key
+        for key in to_remove
+    ])
+    ok_to_delete = input("""The following content types are stale and need to be deleted:
+
+%s
+
+Any objects related to these content types by a foreign key will also
+be deleted. Are you sure you want to delete these content types?
+If you're unsure, answer 'no'.
+
+    Type 'yes' to continue, or 'no' to cancel: """ % content_type_display)
+    return ok_to_delete == 'yes'
+
+
+def sync_contenttypes(apps, verbosity=2, db=DEFAULT_CONNECTION_NAME,
+                      interactive=False, dry_run=False, **kwargs):
+    """
+    Creates content types for the documents of the given apps and removes
+    the entries of those apps that no longer have a matching document class.
+
+    The existing content types are read with one query and the changes are
+    applied with one bulk write. Returns the ``(to_add, to_remove)`` lists
+    of ``(app_label, document_name)`` pairs; with ``dry_run`` nothing is
+    written and the diff is only printed.
+    """
+    try:
+        get_document('contenttypes.ContentType')
+    except NotRegistered:
+        return [], []
+
+    expected = set()
+    for app in apps:
+        for document in get_documents(app):
+            expected.add((get_app_label(document), document.__name__))
+    if not expected:
+        return [], []
+
+    collection = get_db(db)[ContentType._get_collection_name()]
+    existing = {}
+    for ct in collection.find(
+            {'app_label': {'$in': sorted(set(label for label, _ in expected))}},
+            {'app_label': 1, 'document': 1}):
+        existing[(ct['app_label'], ct['document'])] = ct['_id']
+
+    to_add = sorted(key for key in expected if key not in existing)
+    to_remove = sorted(key for key in existing if key not in expected)
+
+    if dry_run:
+        if verbosity >= 1:
+            for key in to_add:
+                print("+ %s | %s" % key)
+            for key in to_remove:
+                print("- %s | %s" % key)
+        return to_add, to_remove
+
+    # Confirm that the content types are stale before deletion.
+    if to_remove and not (interactive and _confirm_removal(to_remove)):
+        if verbosity >= 2:
+            print("Stale content types remain.")
+        to_remove = []
+
+    requests = [
+        UpdateOne({'app_label': app_label, 'document': document_name},
+                  {'$setOnInsert': {'app_label': app_label,
+                                    'document': document_name,
+                                    'name': document_name}},
+                  upsert=True)
+        for app_label, document_name in to_add
+    ]
+    if to_remove:
+        requests.append(DeleteMany(
+            {'_id': {'$in': [existing[key] for key in to_remove]}}))
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+        ContentType.objects.clear_cache(using=db)
+
+    if verbosity >= 2:
+        for key in to_add:
+            print("Adding content type '%s | %s'" % key)
+        for key in to_remove:
+            print("Deleting stale content type '%s | %s'" % key)
+    return to_add, to_remove
+
+
+def update_contenttypes(app, created_documents, verbosity=2, db=DEFAULT_CONNECTION_NAME, **kwargs):
+    """
+    Creates content types for documents in the given app, removing any document
+    entries that no longer have a matching document class.
+    """
+    return sync_contenttypes([app], verbosity, db, **kwargs)
+
+
+def update_all_contenttypes(verbosity=2, **kwargs):
+    """Synchronizes the content types of every app in a single pass."""
+    return sync_contenttypes(get_apps(), verbosity, **kwargs)
+
+
+# The collection holding the fingerprint of the last synchronization of each
+# database, so that only the first process of a deploy synchronizes.
+FINGERPRINTS_COLLECTION = 'extras_mongoengine_contenttypes_fingerprints'
+
+_synced = {}
+_synced_lock = threading.Lock()
+
+
+def get_documents_fingerprint():
+    """Returns a hash of the (app_label, document_name) pairs of every
+    installed document."""
+    keys = sorted(set(
+        (get_app_label(document), document.__name__)
+        for document in get_documents()
+    ))
+    return sha1(repr(keys).encode('utf-8')).hexdigest()
+
+
+def _get_fingerprints(db):
+    return get_db(db)[FINGERPRINTS_COLLECTION]
+
+
+def store_documents_fingerprint(db=DEFAULT_CONNECTION_NAME, fingerprint=None):
+    """Records that the content types of ``db`` match the installed
+    documents, so that ``ensure_contenttypes`` skips them."""
+    if fingerprint is None:
+        fingerprint = get_documents_fingerprint()
+    _get_fingerprints(db).replace_one(
+        {'_id': 'documents'}, {'fingerprint': fingerprint}, upsert=True)
+
+
+def ensure_contenttypes(verbosity=0, db=DEFAULT_CONNECTION_NAME, force=False):
+    """
+    Synchronizes the content types once per set of installed documents, e.g.
+    from a WSGI entry point or a worker startup. Later calls in the same
+    process, and calls in other processes once the fingerprint of the
+    documents has been stored in the database, return ``False`` without
+    synchronizing; stale content types are never removed here (see the
+    ``sync_contenttypes`` management command).
+    """
+    fingerprint = get_documents_fingerprint()
+    with _synced_lock:
+        if not force and _synced.get(db) == fingerprint:
+            return False
+        stored = _get_fingerprints(db).find_one({'_id': 'documents'})
+        if force or stored is None or stored.get('fingerprint') != fingerprint:
+            update_all_contenttypes(verbosity, db=db)
+            store_documents_fingerprint(db, fingerprint)
+            synced = True
+        else:
+            synced = False
+        _synced[db] = fingerprint
+    return synced
+
+if __name__ == "__main__":
+    update_all_contenttypes()
@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+
+from extras_mongoengine.contrib.contenttypes.management import (
+    store_documents_fingerprint, sync_contenttypes)
+from extras_mongoengine.utils import get_apps
+
+
+OPTIONS = (
+    (('--noinput',), dict(action='store_false', dest='interactive', default=True,
+        help='Do not prompt before deleting stale content types; keep them.')),
+    (('--dry-run',), dict(action='store_true', dest='dry_run', default=False,
+        help='Only print the content types that would be added or removed.')),
+    (('--database',), dict(action='store', dest='database',
+        default=DEFAULT_CONNECTION_NAME,
+        help='The connection alias to synchronize. Defaults to "default".')),
+)
+
+
+class Command(BaseCommand):
+    help = ('Creates the content types of every installed document and '
+            'removes the stale ones, in a single bulk write.')
+
+    if hasattr(BaseCommand, 'option_list'):
+        # Django < 1.8
+        option_list = BaseCommand.option_list + tuple(
+            make_option(*args, **kwargs) for args, kwargs in OPTIONS)
+
+    def add_arguments(self, parser):
+        for args, kwargs in OPTIONS:
+            parser.add_argument(*args, **kwargs)
+
+    def handle(self, *args, **options):
+        db = options['database']
+        sync_contenttypes(get_apps(), int(options.get('verbosity', 1)), db,
+                          interactive=options['interactive'],
+                          dry_run=options['dry_run'])
+        if not options['dry_run']:
+            # Processes started later can skip ensure_contenttypes().
+            store_documents_fingerprint(db)
@@ -1,29 +1,73 @@
 # coding: utf-8
 from __future__ import unicode_literals
+import operator
+import threading
+from functools import reduce
 from inspect import isclass
 
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
-from mongoengine import Document
+from mongoengine import Document, signals
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_db
 from mongoengine.base import get_document as mongoengine_get_document
 from mongoengine.fields import StringField
-from mongoengine.queryset import QuerySet
+from mongoengine.queryset import Q, QuerySet
+from pymongo import UpdateOne
+from extras_mongoengine.cache import CacheNamespace
 from extras_mongoengine.utils import get_app_label, get_document
 
 
 class ContentTypeQuerySet(QuerySet):
 
     # Cache to avoid re-looking up ContentType objects all over the place.
-    # This cache is shared by all the get_for_* methods.
+    # This cache is shared by all the get_for_* methods. It maps connection
+    # aliases to CacheNamespaces holding {(app_label, document): ct, ct.id: ct};
+    # their backend is configured by the 'contenttypes' entry of the
+    # EXTRAS_MONGOENGINE_CACHES setting (see extras_mongoengine.cache).
     _cache = {}
+    _cache_lock = threading.Lock()
 
-    # In the case I find out how to get current DB
-    db = 'default'
+    # Connection aliases whose lookups never create missing ContentTypes
+    # and raise DoesNotExist instead; see warm_cache().
+    _read_only = {}
+
+    # The alias given to using(); switch_db restores the document's _meta
+    # afterwards, so the queryset has to remember it.
+    _db_alias = None
+
+    @property
+    def db(self):
+        """The alias of the connection ContentTypes are read from."""
+        return (self._db_alias or self._document._meta.get('db_alias')
+                or DEFAULT_CONNECTION_NAME)
+
+    @property
+    def read_only(self):
+        return self._read_only.get(self.db, False)
+
+    def using(self, alias):
+        queryset = super(ContentTypeQuerySet, self).using(alias)
+        queryset._db_alias = alias
+        return queryset
+
+    def clone(self):
+        queryset = super(ContentTypeQuerySet, self).clone()
+        queryset._db_alias = self._db_alias
+        return queryset
+
+    @classmethod
+    def _get_cache(cls, using):
+        try:
+            return cls._cache[using]
+        except KeyError:
+            with cls._cache_lock:
+                return cls._cache.setdefault(
+                    using, CacheNamespace('contenttypes:%s' % using))
 
     def get_by_natural_key(self, app_label, document):
         try:
-            ct = self.__class__._cache[self.db][(app_label, document)]
+            ct = self._get_cache(self.db)[(app_label, document)]
         except KeyError:
             ct = self.get(app_label=app_label, document=document)
             self._add_to_cache(self.db, ct)
@@ -37,7 +81,7 @@ class ContentTypeQuerySet(QuerySet):
 
     def _get_from_cache(self, opts):
         key = (opts['app_label'], opts['document_name'])
-        return self.__class__._cache[self.db][key]
+        return self._get_cache(self.db)[key]
 
     def get_for_document(self, document):
         """
@@ -52,6 +96,11 @@ class ContentTypeQuerySet(QuerySet):
         try:
             ct = self._get_from_cache(opts)
         except KeyError:
+            if self.read_only:
+                ct = self.get(app_label=opts['app_label'],
+                              document=opts['document_name'])
+                self._add_to_cache(self.db, ct)
+                return ct
             # Load or create the ContentType entry.
             ct = self.filter(
                 app_label=opts['app_label'],
@@ -65,55 +114,77 @@ class ContentTypeQuerySet(QuerySet):
     def get_for_documents(self, *documents, **kwargs):
         """
         Given *documents, returns a dictionary mapping {document: content_type}.
+        Cache misses are fetched with one query on the exact (app_label,
+        document) pairs, and the ContentTypes still missing are created with
+        a single bulk upsert.
         """
         # Final results
         results = {}
-        # documents that aren't already in the cache
-        needed_app_labels = set()
-        needed_documents = set()
-        needed_opts = set()
+        # (app_label, document_name) -> document, for documents that aren't
+        # already in the cache
+        needed = {}
         for document in documents:
             opts = self._get_opts(document)
             try:
                 ct = self._get_from_cache(opts)
             except KeyError:
-                needed_app_labels.add(opts['app_label'])
-                needed_documents.add(opts['document_name'])
-                needed_opts.add((opts['app_label'], opts['document_name']))
+                needed[(opts['app_label'], opts['document_name'])] = document
             else:
                 results[document] = ct
-        if needed_opts:
-            cts = self.filter(
-                app_label__in=needed_app_labels,
-                document__in=needed_documents
-            )
-            for ct in cts:
-                document = ct.document_class()
-                opts = self._get_opts(document)
-                key = (opts['app_label'], opts['document_name'])
-                if key in needed_opts:
-                    results[document] = ct
-                    needed_opts.remove(key)
+        if needed:
+            for ct in self._filter_pairs(needed):
                 self._add_to_cache(self.db, ct)
-        for app_label, document_name in needed_opts:
+                document = needed.pop((ct.app_label, ct.document), None)
+                if document is not None:
+                    results[document] = ct
+        if needed and self.read_only:
+            raise self._document.DoesNotExist(
+                "No ContentType for %s" % ", ".join(
+                    "%s.%s" % key for key in sorted(needed)))
+        if needed:
             # These weren't in the cache, or the DB, create them.
-            ct = self.filter(
-                app_label=app_label,
-                document=document_name
-            ).modify(upsert=True, new=True,
-                app_label=app_label, document=document_name, name=document_name)
-
-            self._add_to_cache(self.db, ct)
-            results[ct.document_class()] = ct
+            keys = sorted(needed)
+            upserted = self._collection.bulk_write([
+                UpdateOne({'app_label': app_label, 'document': document_name},
+                          {'$setOnInsert': {'app_label': app_label,
+                                            'document': document_name,
+                                            'name': document_name}},
+                          upsert=True)
+                for app_label, document_name in keys
+            ], ordered=False).upserted_ids
+            for index, (app_label, document_name) in enumerate(keys):
+                if index not in upserted:
+                    # Created concurrently by someone else, fetched below.
+                    continue
+                ct = self._document._from_son({
+                    '_id': upserted[index],
+                    'app_label': app_label,
+                    'document': document_name,
+                    'name': document_name,
+                })
+                self._add_to_cache(self.db, ct)
+                results[needed.pop((app_label, document_name))] = ct
+            if needed:
+                for ct in self._filter_pairs(needed):
+                    self._add_to_cache(self.db, ct)
+                    results[needed[(ct.app_label, ct.document)]] = ct
         return results
 
+    def _filter_pairs(self, keys):
+        """Returns the ContentTypes matching the given (app_label, document)
+        pairs exactly."""
+        return self.filter(reduce(operator.or_, [
+            Q(app_label=app_label, document=document_name)
+            for app_label, document_name in keys
+        ]))
+
     def get_for_id(self, object_id):
         """
         Lookup a ContentType by ID. Uses the same shared cache as get_for_document
         (though ContentTypes are obviously not created on-the-fly by get_by_id).
         """
         try:
-            ct = self.__class__._cache[self.db][object_id]
+            ct = self._get_cache(self.db)[object_id]
         except KeyError:
             # This could raise a DoesNotExist; that's correct behavior and will
             # make sure that only correct ctypes get stored in the cache dict.
@@ -121,22 +192,57 @@ class ContentTypeQuerySet(QuerySet):
             self._add_to_cache(self.db, ct)
         return ct
 
-    def clear_cache(self):
+    def warm_cache(self, read_only=None):
+        """
+        Loads the ContentTypes of the queryset into the cache of its
+        connection with a single query, e.g. at worker startup, and returns
+        how many were loaded. Cached entries are replaced, not cleared. With
+        ``read_only=True`` later lookups of unknown documents on that
+        connection no longer upsert a ContentType, so the get_for_* methods
+        never write.
+        """
+        cts = list(self.clone())
+        entries = {}
+        for ct in cts:
+            entries[(ct.app_label, ct.document)] = ct
+            entries[ct.id] = ct
+        self._get_cache(self.db).set_many(entries)
+        if read_only is not None:
+            self._read_only[self.db] = read_only
+        return len(cts)
+
+    def clear_cache(self, using=None):
         """
         Clear out the content-type cache. This needs to happen during database
         flushes to prevent caching of "stale" content type IDs (see
         django.contrib.contenttypes.management.update_contenttypes for where
-        this gets called).
+        this gets called). If ``using`` is given, only the cache of that
+        connection alias is cleared.
         """
-        self.__class__._cache.clear()
+        if using is None:
+            caches = list(self._cache.values())
+        else:
+            caches = [self._get_cache(using)]
+        for cache in caches:
+            cache.clear()
+
+    def evict(self, ct, using=None):
+        """Remove a single ContentType from the cache."""
+        cache = self._get_cache(using or self.db)
+        keys = [ct.id, (ct.app_label, ct.document)]
+        cached = cache.get(ct.id)
+        if cached is not None:
+            keys.append((cached.app_label, cached.document))
+        cache.invalidate(*keys)
 
     def _add_to_cache(self, using, ct):
         """Insert a ContentType into the cache."""
         # Note it's possible for ContentType objects to be stale; document_class() will return None.
         # Hence, there is no reliance on document._meta.app_label here, just using the document fields instead.
         key = (ct.app_label, ct.document)
-        self.__class__._cache.setdefault(using, {})[key] = ct
-        self.__class__._cache.setdefault(using, {})[ct.id] = ct
+        cache = self._get_cache(using)
+        cache[key] = ct
+        cache[ct.id] = ct
 
 
 
@@ -204,3 +310,20 @@ class ContentType(Document):
 
     def natural_key(self):
         return (self.app_label, self.document)
+
+
+def evict_content_type(sender, document, **kwargs):
+    """
+    Drops a saved or deleted ContentType from the caches of the connection
+    it was written to (see Document.switch_db), so the cache never keeps a
+    stale app_label/document pair.
+    """
+    aliases = set([document._meta.get('db_alias') or DEFAULT_CONNECTION_NAME])
+    db = document._get_db()
+    for alias in list(ContentTypeQuerySet._cache):
+        if get_db(alias) == db:
+            aliases.add(alias)
+    for alias in aliases:
+        ContentType.objects.evict(document, using=alias)
+signals.post_save.connect(evict_content_type, sender=ContentType)
+signals.post_delete.connect(evict_content_type, sender=ContentType)
@@ -5,8 +5,13 @@ from django.utils.http import urlquote
 from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
 
-from mongoengine import Document, fields
+from mongoengine import Document, connect, fields
+from mongoengine.connection import get_db
+from mongoengine.context_managers import switch_db
 from mongoengine.django.tests import MongoTestCase
+from extras_mongoengine.contrib.contenttypes import management
+from extras_mongoengine.contrib.contenttypes.management import (
+    ensure_contenttypes, sync_contenttypes)
 from extras_mongoengine.contrib.contenttypes.models import ContentType
 from extras_mongoengine.contrib.sites.models import Site
 from extras_mongoengine.utils import register_documents
@@ -53,6 +58,19 @@ class ContentTypesTests(MongoTestCase):
             Site: ContentType.objects.get_for_document(Site),
         })
 
+    def test_get_for_models_exact_pairs(self):
+        # A leftover ('contenttypes', 'Site') pair is part of the
+        # app_label x document cross product, but not a match.
+        ContentType.objects.create(
+            name='Site',
+            app_label='contenttypes',
+            document='Site',
+        )
+        cts = ContentType.objects.get_for_documents(ContentType, Site)
+        self.assertEqual(cts[Site].app_label, 'sites')
+        self.assertEqual(cts[ContentType].app_label, 'contenttypes')
+        self.assertEqual(ContentType.objects.count(), 3)
+
     def test_missing_model(self):
         """
         Ensures that displaying content types in admin (or anywhere) doesn't
@@ -72,3 +90,129 @@ class ContentTypesTests(MongoTestCase):
         # Instead, just return the ContentType object and let the app detect stale states.
         ct_fetched = ContentType.objects.get_for_id(ct.pk)
         self.assertIsNone(ct_fetched.document_class())
+
+    def test_cache_is_per_connection_alias(self):
+        ct = ContentType.objects.get_for_document(Site)
+        cache = ContentType.objects._get_cache(ContentType.objects.db)
+        self.assertIn(ct.id, cache)
+        ContentType.objects.clear_cache(using='other')
+        self.assertIn(ct.id, cache)
+        ContentType.objects.clear_cache(using=ContentType.objects.db)
+        self.assertNotIn(ct.id, cache)
+
+    def test_using_keeps_caches_of_aliases_apart(self):
+        connect(db='extrasmongoenginetest_other', alias='other')
+        other = ContentType.objects.using('other')
+        try:
+            ct = ContentType.objects.get_for_document(Site)
+            other_ct = other.get_for_document(Site)
+            self.assertNotEqual(ct.id, other_ct.id)
+            self.assertEqual(other.filter(app_label='sites').db, 'other')
+            self.assertIn(other_ct.id, ContentType.objects._get_cache('other'))
+            self.assertNotIn(other_ct.id, ContentType.objects._get_cache(ContentType.objects.db))
+            self.assertEqual(other.get_for_document(Site).id, other_ct.id)
+            self.assertEqual(other.get_for_id(other_ct.id).id, other_ct.id)
+            self.assertRaises(ContentType.DoesNotExist,
+                              ContentType.objects.get_for_id, other_ct.id)
+        finally:
+            ContentType.objects.clear_cache(using='other')
+            get_db('other').drop_collection(ContentType._get_collection_name())
+
+    def test_delete_evicts_from_cache(self):
+        ct = ContentType.objects.get_for_document(Site)
+        ct.delete()
+        cache = ContentType.objects._get_cache(ContentType.objects.db)
+        self.assertNotIn(ct.id, cache)
+        self.assertNotIn((ct.app_label, ct.document), cache)
+
+    def test_save_evicts_from_the_cache_of_its_alias(self):
+        connect(db='extrasmongoenginetest_other', alias='other')
+        other = ContentType.objects.using('other')
+        try:
+            ct = other.get_for_document(Site)
+            cache = ContentType.objects._get_cache('other')
+            self.assertIn(ct.id, cache)
+            ct.switch_db('other')
+            ct.name = 'Renamed'
+            ct.save()
+            self.assertNotIn(ct.id, cache)
+
+            ct = other.get_for_id(ct.id)
+            self.assertIn(ct.id, cache)
+            with switch_db(ContentType, 'other') as cls:
+                cls.objects.get(pk=ct.id).delete()
+            self.assertNotIn(ct.id, cache)
+        finally:
+            ContentType.objects.clear_cache(using='other')
+            get_db('other').drop_collection(ContentType._get_collection_name())
+
+    def test_warm_cache_of_a_filtered_queryset(self):
+        site_ct = ContentType.objects.get_for_document(Site)
+        ct = ContentType.objects.get_for_document(ContentType)
+        self.assertEqual(
+            ContentType.objects.filter(document='Site').warm_cache(), 1)
+        cache = ContentType.objects._get_cache(ContentType.objects.db)
+        self.assertIn(site_ct.id, cache)
+        self.assertIn(ct.id, cache)
+
+    def test_warm_cache_read_only(self):
+        connect(db='extrasmongoenginetest_other', alias='other')
+        ContentType.objects.get_for_document(Site)
+        ContentType.objects.clear_cache()
+        self.assertEqual(ContentType.objects.warm_cache(read_only=True), 1)
+        try:
+            self.assertEqual(ContentType.objects.get_for_document(Site).document, 'Site')
+            self.assertRaises(ContentType.DoesNotExist,
+                              ContentType.objects.get_for_document, ContentType)
+            self.assertRaises(ContentType.DoesNotExist,
+                              ContentType.objects.get_for_documents, ContentType)
+            self.assertEqual(ContentType.objects.count(), 1)
+            self.assertFalse(ContentType.objects.using('other').read_only)
+        finally:
+            ContentType.objects.warm_cache(read_only=False)
+
+    def test_sync_contenttypes(self):
+        from extras_mongoengine.contrib.sites import models as sites_app
+        ContentType.objects.create(
+            name='OldModel',
+            app_label='sites',
+            document='OldModel',
+        )
+        to_add, to_remove = sync_contenttypes([sites_app], verbosity=0, dry_run=True)
+        self.assertEqual(to_add, [('sites', 'Site')])
+        self.assertEqual(to_remove, [('sites', 'OldModel')])
+        self.assertEqual(ContentType.objects.count(), 1)
+
+        # Stale content types are only removed after confirmation.
+        sync_contenttypes([sites_app], verbosity=0)
+        self.assertEqual(sorted(ContentType.objects.scalar('document')),
+                         ['OldModel', 'Site'])
+        self.assertEqual(sync_contenttypes([sites_app], verbosity=0, dry_run=True),
+                         ([], [('sites', 'OldModel')]))
+
+    def test_sync_contenttypes_of_another_alias(self):
+        from extras_mongoengine.contrib.sites import models as sites_app
+        connect(db='extrasmongoenginetest_other', alias='other')
+        other = get_db('other')
+        try:
+            sync_contenttypes([sites_app], verbosity=0, db='other')
+            self.assertEqual(
+                other[ContentType._get_collection_name()].find_one()['document'],
+                'Site')
+            self.assertEqual(ContentType.objects.count(), 0)
+        finally:
+            other.drop_collection(ContentType._get_collection_name())
+
+    def test_ensure_contenttypes_once(self):
+        management._synced.clear()
+        management._get_fingerprints('default').drop()
+        self.assertTrue(ensure_contenttypes())
+        count = ContentType.objects.count()
+        self.assertTrue(count > 0)
+        self.assertFalse(ensure_contenttypes())
+        # Another process of the same deploy only reads the fingerprint.
+        management._synced.clear()
+        ContentType.drop_collection()
+        self.assertFalse(ensure_contenttypes())
+        self.assertEqual(ContentType.objects.count(), 0)
+        management._get_fingerprints('default').drop()
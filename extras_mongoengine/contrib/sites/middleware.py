@@ -0,0 +1,19 @@
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+from extras_mongoengine.contrib.sites.models import Site, get_current_site
+
+
+class CurrentSiteMiddleware(MiddlewareMixin):
+    """
+    Sets ``request.site`` to the ``Site`` matching the host of the request,
+    or to the current site (see ``get_current_site``) when none matches.
+    """
+
+    def process_request(self, request):
+        try:
+            request.site = Site.objects.get_by_host(request.get_host())
+        except Site.DoesNotExist:
+            request.site = get_current_site(request)
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
 import string
+import threading
+import time
 
 from django.conf import settings
 #from django.db import models
@@ -12,9 +14,83 @@ from django.utils.encoding import python_2_unicode_compatible
 from mongoengine import Document, fields, signals
 from mongoengine.queryset import QuerySet
 from mongoengine.errors import ValidationError
+from extras_mongoengine.cache import CacheNamespace
 
 
-SITE_CACHE = {}
+# Its backend is configured by the 'sites' entry of the
+# EXTRAS_MONGOENGINE_CACHES setting (see extras_mongoengine.cache).
+SITE_CACHE = CacheNamespace('sites')
+
+# Seconds during which the host index of get_by_host() is used before it's
+# reloaded; saving or deleting a site reloads it in the current process.
+SITE_HOST_INDEX_TIMEOUT = getattr(settings, 'SITE_HOST_INDEX_TIMEOUT', 60)
+
+
+def split_host(host):
+    """
+    Returns the domain of ``host``: lowercased, without the port and the
+    trailing dot.
+    """
+    host = host.lower()
+    if host.startswith('['):
+        # IPv6 literal, with or without a port
+        return host[:host.index(']') + 1] if ']' in host else host
+    if host.count(':') == 1:
+        host = host.split(':', 1)[0]
+    return host.rstrip('.')
+
+
+class SiteHostIndex(object):
+    """
+    Maps domains to sites, loaded with one query and reloaded every
+    ``timeout`` seconds. A site whose domain is ``*.example.com`` matches
+    every subdomain of ``example.com`` that has no site of its own, the
+    most specific wildcard winning.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._domains = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def _load(self, queryset):
+        domains = {}
+        for site in queryset:
+            if site.domain:
+                domains.setdefault(split_host(site.domain), site)
+        return domains
+
+    def get_domains(self, queryset):
+        domains = self._domains
+        if domains is None or time.time() - self._loaded >= self.timeout:
+            with self._lock:
+                if self._domains is domains:
+                    self._domains = self._load(queryset)
+                    self._loaded = time.time()
+                domains = self._domains
+        return domains
+
+    def lookup(self, queryset, host):
+        domains = self.get_domains(queryset)
+        domain = split_host(host)
+        try:
+            return domains[domain]
+        except KeyError:
+            pass
+        parts = domain.split('.')
+        for i in range(1, len(parts)):
+            try:
+                return domains['*.' + '.'.join(parts[i:])]
+            except KeyError:
+                pass
+        return None
+
+    def expire(self):
+        self._domains = None
+
+
+SITE_HOST_INDEX = SiteHostIndex(SITE_HOST_INDEX_TIMEOUT)
 
 
 def _simple_domain_name_validator(value):
@@ -53,10 +129,23 @@ class SiteQuerySet(QuerySet):
             SITE_CACHE[sid] = current_site
         return current_site
 
+    def get_by_host(self, host):
+        """
+        Returns the ``Site`` whose domain matches ``host`` (as returned by
+        ``request.get_host()``), ignoring the port. Sites are looked up in
+        :data:`SITE_HOST_INDEX`, so this only queries the database when the
+        index is reloaded.
+        """
+        site = SITE_HOST_INDEX.lookup(self._document.objects.all(), host)
+        if site is None:
+            raise self._document.DoesNotExist(
+                "No Site matches the host %r." % host)
+        return site
+
     def clear_cache(self):
         """Clears the ``Site`` object cache."""
-        global SITE_CACHE
-        SITE_CACHE = {}
+        SITE_CACHE.clear()
+        SITE_HOST_INDEX.expire()
 
 
 @python_2_unicode_compatible
@@ -128,12 +217,12 @@ def get_current_site(request):
 
 def clear_site_cache(sender, **kwargs):
     """
-    Clears the cache (if primed) each time a site is saved or deleted
+    Clears the cache (if primed) each time a site has been saved or deleted.
+    Evicting after the write keeps a concurrent request from caching the old
+    site again between the eviction and the write.
     """
     instance = kwargs['document']
-    try:
-        del SITE_CACHE[instance.site_id]
-    except KeyError:
-        pass
-signals.pre_save.connect(clear_site_cache, sender=Site)
-signals.pre_delete.connect(clear_site_cache, sender=Site)
+    SITE_CACHE.invalidate(instance.site_id)
+    SITE_HOST_INDEX.expire()
+signals.post_save.connect(clear_site_cache, sender=Site)
+signals.post_delete.connect(clear_site_cache, sender=Site)
@@ -83,6 +83,19 @@ class SitesFrameworkTests(MongoTestCase):
 
         settings.INSTALLED_APPS = installed_apps
 
+    def test_get_by_host(self):
+        Site(site_id=2, domain="*.example.org", name="tenants").save()
+        Site(site_id=3, domain="www.example.org", name="www").save()
+        self.assertEqual(Site.objects.get_by_host("EXAMPLE.com:8000").site_id,
+                         settings.SITE_ID)
+        self.assertEqual(Site.objects.get_by_host("www.example.org").site_id, 3)
+        self.assertEqual(Site.objects.get_by_host("a.b.example.org").site_id, 2)
+        self.assertRaises(Site.DoesNotExist, Site.objects.get_by_host, "example.org")
+
+        # Saving a site reloads the index
+        Site(site_id=4, domain="example.org", name="root").save()
+        self.assertEqual(Site.objects.get_by_host("example.org").site_id, 4)
+
     def test_domain_name_with_whitespaces(self):
         # Regression for #17320
         # Domain names are not allowed contain whitespace characters
@@ -1,9 +1,17 @@
+import math
 import re
+import threading
+import unicodedata
+from collections import OrderedDict
 from datetime import timedelta
+from numbers import Real
 
-from mongoengine import signals
-from mongoengine.base import BaseField, ValidationError
+from mongoengine import Document, signals
+from mongoengine.base import (BaseField, TopLevelDocumentMetaclass,
+    ValidationError)
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
 from mongoengine.fields import IntField, StringField, EmailField
+from mongoengine.python_support import bin_type
 
 # external deps
 from slugify import slugify
@@ -11,85 +19,490 @@ from slugify import slugify
 
 __all__ = ('SlugField', 'AutoSlugField', 'TimedeltaField',
     'LowerStringField', 'LowerEmailField', 'IntEnumField',
-    'StringEnumField')
+    'StringEnumField', 'LRUCache', 'CachedSlugifier', 'default_slugifier',
+    'LazyValue', 'LazyConversionMixin')
+
+
+class LRUCache(object):
+
+    """A thread-safe mapping that keeps the ``maxsize`` most recently used
+    entries. ``hits`` and ``misses`` count :meth:`get` calls.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'maxsize': self.maxsize, 'currsize': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CachedSlugifier(object):
+
+    """Memoizes a slugify function in an :class:`LRUCache`, so repeated
+    inputs don't pay for unicode transliteration again.
+    """
+
+    def __init__(self, func=slugify, maxsize=1024):
+        self.func = func
+        self.cache = LRUCache(maxsize)
+
+    def __call__(self, value):
+        slug = self.cache.get(value)
+        if slug is None:
+            slug = self.func(value)
+            self.cache.set(value, slug)
+        return slug
+
+
+default_slugifier = CachedSlugifier()
 
 
 class SlugField(StringField):
 
     """A field that validates input as a standard slug.
+
+    :param slugifier: callable turning a value into a slug, used by
+        :meth:`slugify`. Defaults to :data:`default_slugifier`, a memoized
+        ``python-slugify``; pass ``slugify`` itself to disable caching.
     """
     SLUG_REGEX = re.compile(r"^[-\w]+$")
 
+    def __init__(self, *args, **kwargs):
+        self.slugifier = kwargs.pop('slugifier', default_slugifier)
+        super(SlugField, self).__init__(*args, **kwargs)
+
+    def slugify(self, value):
+        return self.slugifier(value)
+
     def validate(self, value):
         if not SlugField.SLUG_REGEX.match(value):
             raise ValidationError('This string is not a slug: %s' % value)
 
 
+def _register_slug_fields(cls):
+    """Stores the ``(fieldname, field)`` pairs of the AutoSlugFields of
+    ``cls`` on the class and connects its ``pre_save`` to
+    create_slug_signal if there are any. Done by the class rather than by
+    the fields, since subclasses and documents deriving from abstract bases
+    share field instances."""
+    slug_fields = tuple(
+        (fieldname, field) for fieldname, field in cls._fields.items()
+        if isinstance(field, AutoSlugField))
+    cls._auto_slug_fields = slug_fields
+    if slug_fields:
+        signals.pre_save.connect(create_slug_signal, sender=cls)
+
+
+def _install_slug_hook():
+    """Wraps TopLevelDocumentMetaclass.__new__ to register the slug fields
+    of every document class when it's created."""
+    metaclass_new = TopLevelDocumentMetaclass.__new__
+
+    def __new__(mcs, name, bases, attrs):
+        cls = metaclass_new(mcs, name, bases, attrs)
+        _register_slug_fields(cls)
+        return cls
+    TopLevelDocumentMetaclass.__new__ = staticmethod(__new__)
+
+
+def _has_changed(document, fieldname, changed_fields):
+    field = document._fields.get(fieldname)
+    if field is None:
+        # populate_from names a plain attribute, changes can't be tracked.
+        return True
+    prefix = field.db_field + '.'
+    return any(key == field.db_field or key.startswith(prefix)
+               for key in changed_fields)
+
+
+def _is_stored(document):
+    """Returns True if ``document`` was loaded from or already saved to the
+    database. A new document may already have a primary key of its own."""
+    created = getattr(document, '_created', None)
+    if created is None:
+        return bool(document.pk)
+    return not created
+
+
 def create_slug_signal(sender, document):
-    for fieldname, field in document._fields.iteritems():
-        if isinstance(field, AutoSlugField):
-            if document.pk and not getattr(field, 'always_update'):
+    changed_fields = None
+    stored = _is_stored(document)
+    for fieldname, field in sender._auto_slug_fields:
+        source = field.populate_from or fieldname
+        if stored:
+            if not field.always_update:
+                continue
+            if changed_fields is None:
+                changed_fields = document._get_changed_fields()
+            if not _has_changed(document, source, changed_fields):
                 continue
 
-            document._data[fieldname] = field._generate_slug(
-                document,
-                getattr(document, field.populate_from or fieldname)
-            )
+        slug = field._generate_slug(document, getattr(document, source))
+        if slug != document._data.get(fieldname):
+            document._data[fieldname] = slug
+            if stored:
+                document._mark_as_changed(fieldname)
+
+
+class SlugCounter(Document):
+
+    """Per-slug allocation counter used by the ``counter`` strategy of
+    :class:`AutoSlugField`. ``n`` is the number of slugs handed out for
+    the base slug stored in ``id``."""
+    id = StringField(primary_key=True)
+    n = IntField(default=0)
+
+    meta = {
+        'collection': 'extras_mongoengine_slug_counters',
+    }
 
 
 class AutoSlugField(SlugField):
 
     """A field that that produces a slug from the inputs and auto-
-    increments the slug if the value already exists."""
+    increments the slug if the value already exists.
+
+    :param slug_strategy: how collisions are resolved.
+
+        * ``'probe'`` - try ``slug``, ``slug-1``, ``slug-2``... with one
+          ``count()`` per candidate (fills gaps, O(n) queries);
+        * ``'regex'`` (default) - fetch every ``slug``/``slug-N`` value in
+          one anchored regex query and pick the highest suffix + 1;
+        * ``'counter'`` - atomically increment a per-slug counter stored in
+          the ``extras_mongoengine_slug_counters`` collection. The counter
+          is seeded with a ``'regex'`` lookup the first time a slug is seen.
+    """
+
+    SLUG_STRATEGIES = ('probe', 'regex', 'counter')
 
     def __init__(self, *args, **kwargs):
         self.populate_from = kwargs.pop('populate_from', None)
         self.always_update = kwargs.pop('always_update', False)
+        self.slug_strategy = kwargs.pop('slug_strategy', 'regex')
+        if self.slug_strategy not in self.SLUG_STRATEGIES:
+            raise ValueError('Unknown slug_strategy %r, expected one of %s' %
+                             (self.slug_strategy, ', '.join(self.SLUG_STRATEGIES)))
         kwargs['unique'] = True
         super(AutoSlugField, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def assign_slugs(cls, documents):
+        """Fills in every :class:`AutoSlugField` of a batch of documents and
+        returns them as a list, e.g. before a bulk insert (which doesn't send
+        ``pre_save``)::
+
+            Article.objects.insert(AutoSlugField.assign_slugs(articles))
+
+        Collisions are resolved against the database with one lookup per
+        distinct base slug, and against the other documents of the batch.
+        """
+        documents = list(documents)
+        by_class = {}
+        for document in documents:
+            by_class.setdefault(document.__class__, []).append(document)
+        for document_cls, batch in by_class.items():
+            for fieldname, field in getattr(document_cls, '_auto_slug_fields', ()):
+                field._assign_batch(document_cls, fieldname, batch)
+        return documents
+
+    def _assign_batch(self, cls, fieldname, documents):
+        by_slug = {}
+        order = []
+        stored = set()
+        for document in documents:
+            if _is_stored(document):
+                if not self.always_update:
+                    continue
+                stored.add(id(document))
+            slug = self.slugify(getattr(document, self.populate_from or fieldname))
+            current = document._data.get(fieldname)
+            if (current and id(document) in stored
+                    and self._is_derived(current, slug)):
+                # Keep the stored slug, as _generate_slug does.
+                continue
+            if slug not in by_slug:
+                by_slug[slug] = []
+                order.append(slug)
+            by_slug[slug].append(document)
+
+        # Bases that are themselves slug-N lookalikes ("Hello 1") must not be
+        # handed out again as suffixes of another base of the same batch.
+        reserved = set(order)
+        for slug in order:
+            batch = by_slug[slug]
+            reserved.discard(slug)
+            slugs = self._allocate(cls, slug, len(batch), reserved)
+            reserved.update(slugs)
+            for document, slug_attempt in zip(batch, slugs):
+                document._data[fieldname] = slug_attempt
+                if id(document) in stored:
+                    document._mark_as_changed(fieldname)
+
     def _generate_slug(self, instance, value):
-        count = 1
-        slug = slug_attempt = slugify(value)
-        cls = instance.__class__
+        slug = self.slugify(value)
+        current = instance._data.get(self.name)
+        if current and _is_stored(instance) and self._is_derived(current, slug):
+            # The stored slug already belongs to this base, keep it rather
+            # than bumping it past itself.
+            return current
+        return self._allocate(instance.__class__, slug, 1)[0]
+
+    @staticmethod
+    def _is_derived(value, slug):
+        """Returns True if ``value`` is ``slug`` or ``slug-N``."""
+        if value == slug:
+            return True
+        return value.startswith(slug + '-') and value[len(slug) + 1:].isdigit()
+
+    def _allocate(self, cls, slug, count, reserved=()):
+        """Returns ``count`` free slugs derived from ``slug``, skipping the
+        values in ``reserved``."""
+        allocate = getattr(self, '_allocate_%s' % self.slug_strategy)
+        return allocate(cls, slug, count, reserved)
+
+    def _allocate_probe(self, cls, slug, count, reserved):
+        if count > 1 or reserved:
+            # Probing a batch would cost one query per candidate and document.
+            return self._allocate_regex(cls, slug, count, reserved)
+        n = 1
+        slug_attempt = slug
         while cls.objects(**{self.db_field: slug_attempt}).count() > 0:
-            slug_attempt = '%s-%s' % (slug, count)
-            count += 1
-        return slug_attempt
+            slug_attempt = '%s-%s' % (slug, n)
+            n += 1
+        return [slug_attempt]
+
+    def _allocate_regex(self, cls, slug, count, reserved):
+        base_taken, highest = self._taken_suffixes(cls, slug, reserved)
+        slugs = [] if base_taken else [slug]
+        slugs.extend('%s-%s' % (slug, n)
+                     for n in range(highest + 1, highest + 1 + count - len(slugs)))
+        return slugs
+
+    def _allocate_counter(self, cls, slug, count, reserved):
+        key = '%s.%s:%s' % (cls._get_collection_name(), self.db_field, slug)
+        # The counters live next to the slugged documents.
+        counters = SlugCounter.objects.using(
+            cls._meta.get('db_alias') or DEFAULT_CONNECTION_NAME)
+        counter = counters(id=key).modify(
+            upsert=True, new=True, inc__n=count)
+        if counter.n == count:
+            # Fresh counter: documents saved before the counter existed (or
+            # with another strategy) still have to be respected.
+            slugs = self._allocate_regex(cls, slug, count, reserved)
+            if slugs[-1] != slug:
+                n = int(slugs[-1].rsplit('-', 1)[1]) + 1
+                counters(id=key, n__lt=n).update_one(set__n=n)
+            return slugs
+        slugs = []
+        while True:
+            candidates = ['%s-%s' % (slug, n - 1)
+                          for n in range(counter.n - count + 1, counter.n + 1)]
+            # Slugs of lookalike bases ("Hello 1") are created without going
+            # through this counter: skip past them.
+            taken = set(cls.objects(**{'%s__in' % self.name: candidates})
+                           .scalar(self.name))
+            taken.update(candidate for candidate in candidates
+                         if candidate in reserved)
+            slugs.extend(candidate for candidate in candidates
+                         if candidate not in taken)
+            count = len(taken)
+            if not count:
+                return slugs
+            counter = counters(id=key).modify(
+                upsert=True, new=True, inc__n=count)
+
+    def _taken_suffixes(self, cls, slug, reserved=()):
+        """Returns ``(base_taken, highest_suffix)`` for ``slug``, fetched in a
+        single query. The regex is anchored, so it can use the unique index.
+        """
+        pattern = '^%s(-[0-9]+)?$' % re.escape(slug)
+        taken = list(cls.objects(__raw__={self.db_field: {'$regex': pattern}})
+                        .scalar(self.name))
+        taken.extend(value for value in reserved if re.match(pattern, value))
+        base_taken = False
+        highest = 0
+        for value in taken:
+            if value == slug:
+                base_taken = True
+            else:
+                highest = max(highest, int(value[len(slug) + 1:]))
+        return base_taken, highest
 
-    def __get__(self, instance, owner):
-        # mongoengine calls this after document initialization
-        if not hasattr(self, 'owner'):
-            self.owner = owner
-            signals.pre_save.connect(create_slug_signal, sender=owner)
 
-        return super(AutoSlugField, self).__get__(instance, owner)
+# Installed once AutoSlugField, which the hook looks for, is defined.
+_install_slug_hook()
+
+
+class LazyValue(object):
+    """A raw database value whose conversion to python has been deferred."""
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+
+class LazyConversionMixin(object):
+    """Lets a field defer ``to_python`` until the first attribute access when
+    created with ``lazy=True``. Loaded documents keep the raw value wrapped in
+    a :class:`LazyValue`, and the converted value replaces it on first read.
+    Unread values are saved back as they were loaded.
+
+    Only applies to fields declared directly on a document: ``lazy`` is
+    ignored by fields nested in a ``ListField`` or ``DictField``, whose
+    values are never read through :meth:`__get__`.
+    """
+
+    # Whether the field is declared directly on its owner document; None
+    # until the owner document is known.
+    _lazy_bound = None
 
+    def __init__(self, *args, **kwargs):
+        self.lazy = kwargs.pop('lazy', False)
+        super(LazyConversionMixin, self).__init__(*args, **kwargs)
+
+    def _defers(self):
+        """Returns True if ``to_python`` should defer conversions."""
+        if not self.lazy:
+            return False
+        bound = self._lazy_bound
+        if bound is None:
+            owner = getattr(self, 'owner_document', None)
+            if owner is None:
+                return False
+            bound = self._lazy_bound = owner._fields.get(self.name) is self
+        return bound
 
-class TimedeltaField(BaseField):
+    def __get__(self, instance, owner):
+        if instance is not None:
+            value = instance._data.get(self.name)
+            if value.__class__ is LazyValue:
+                instance._data[self.name] = self.to_python(value)
+        return super(LazyConversionMixin, self).__get__(instance, owner)
+
+
+class TimedeltaField(LazyConversionMixin, BaseField):
     """A timedelta field.
 
     Looks to the outside world like a datatime.timedelta, but stores
     in the database as an integer (or float) number of seconds.
 
+    :param unit: storage unit, ``'seconds'`` (default, integer or float),
+        ``'milliseconds'`` or ``'microseconds'``. The last two are stored as
+        integers, which avoids float rounding and keeps range queries on an
+        index exact. Plain numbers are read in the storage unit on every
+        path (constructor, assignment, queries), as loaded values are, and
+        are floored to an integer like timedeltas are.
+    :param lazy: defer the conversion of loaded values to the first
+        attribute access, see :class:`LazyConversionMixin`.
+
     """
+    UNITS = {'seconds': 1, 'milliseconds': 1000, 'microseconds': 1000000}
+
+    def __init__(self, *args, **kwargs):
+        self.unit = kwargs.pop('unit', 'seconds')
+        if self.unit not in self.UNITS:
+            raise ValueError('Unknown unit %r, expected one of %s' %
+                             (self.unit, ', '.join(sorted(self.UNITS))))
+        self._scale = self.UNITS[self.unit]
+        super(TimedeltaField, self).__init__(*args, **kwargs)
+
     def validate(self, value):
-        if not isinstance(value, (timedelta, int, float)):
+        if value.__class__ is LazyValue:
+            value = value.raw
+        if not isinstance(value, (timedelta, Real)):
             self.error(u'cannot parse timedelta "%r"' % value)
 
     def to_mongo(self, value):
+        if value.__class__ is LazyValue:
+            return value.raw
         return self.prepare_query_value(None, value)
 
     def to_python(self, value):
-        return timedelta(seconds=value)
+        if value.__class__ is LazyValue:
+            value = value.raw
+        elif isinstance(value, timedelta):
+            return value
+        elif self._defers():
+            return LazyValue(value)
+        if self._scale == 1:
+            return timedelta(seconds=value)
+        return timedelta(microseconds=int(math.floor(value)) * (1000000 // self._scale))
 
     def prepare_query_value(self, op, value):
         if value is None:
             return value
         if isinstance(value, timedelta):
-            return self.total_seconds(value)
-        if isinstance(value, (int, float)):
-            return value
+            if self._scale == 1:
+                return self.total_seconds(value)
+            microseconds = ((value.days * 24 * 3600 + value.seconds) * 1000000 +
+                            value.microseconds)
+            return microseconds // (1000000 // self._scale)
+        if isinstance(value, Real):
+            if self._scale == 1:
+                return value
+            return int(math.floor(value))
+
+    def to_mongo_many(self, values):
+        """Converts an iterable of timedeltas (or numbers in the storage unit)
+        to stored values."""
+        prepare = self.prepare_query_value
+        return [prepare(None, value) for value in values]
+
+    def to_python_many(self, values):
+        """Converts an iterable of stored values to timedeltas."""
+        to_python = self.to_python
+        return [None if value is None else to_python(value) for value in values]
+
+    def to_seconds_many(self, values, as_array=False):
+        """Converts an iterable of stored values to seconds without building
+        timedeltas. With ``as_array=True`` a float NumPy array is returned
+        instead of a list, missing values becoming ``nan``.
+        """
+        if as_array:
+            import numpy
+            array = numpy.array(values, dtype=float)
+            return array / self._scale if self._scale != 1 else array
+        scale = float(self._scale)
+        return [None if value is None else value / scale for value in values]
+
+    def raw_seconds(self, queryset, as_array=False):
+        """Reads this field from every document of ``queryset`` as seconds,
+        straight from the raw query results (see :meth:`to_seconds_many`).
+        """
+        db_field = self.db_field
+        values = [son.get(db_field)
+                  for son in queryset.only(self.name).as_pymongo()]
+        return self.to_seconds_many(values, as_array)
 
     @staticmethod
     def total_seconds(value):
@@ -105,61 +518,194 @@ class TimedeltaField(BaseField):
                    (value.microseconds / 1000000.0)
 
 
+_NON_ASCII_REGEX = re.compile(u'[^\x00-\x7f]')
+
+if hasattr(u'', 'casefold'):
+    def _casefold(value):
+        return value.casefold()
+else:
+    # Python 2 has no full case folding.
+    def _casefold(value):
+        return value.lower()
+
+
 class LowerStringField(StringField):
+    """A :class:`StringField` normalizing its values (and query values) to
+    lowercase. ``iexact`` and ``istartswith`` lookups are rewritten into an
+    exact match and an anchored prefix regex, so they can use an index.
+
+    :param normalization: ``'lower'`` (default), ``'casefold'`` (full Unicode
+        case folding, the German sharp s becoming ``'ss'``; same as
+        ``'lower'`` on Python 2) or ``'nfkc_casefold'`` (NFKC normalization,
+        then case folding).
+    """
+    NORMALIZATIONS = ('lower', 'casefold', 'nfkc_casefold')
+
+    def __init__(self, *args, **kwargs):
+        self.normalization = kwargs.pop('normalization', 'lower')
+        if self.normalization not in self.NORMALIZATIONS:
+            raise ValueError('Unknown normalization %r, expected one of %s' %
+                             (self.normalization, ', '.join(self.NORMALIZATIONS)))
+        super(LowerStringField, self).__init__(*args, **kwargs)
+
     def __set__(self, instance, value):
         value = self.to_python(value)
         return super(LowerStringField, self).__set__(instance, value)
 
+    def normalize(self, value):
+        if not value:
+            return value
+        if self.normalization != 'lower' and isinstance(value, bin_type):
+            # unicodedata and casefold() only take unicode strings.
+            value = value.decode('utf-8')
+        # Already normalized values are returned as they are: islower() only
+        # scans the string while lower() always builds a copy.
+        if value.islower() and (self.normalization == 'lower' or
+                                not _NON_ASCII_REGEX.search(value)):
+            return value
+        if self.normalization == 'lower':
+            return value.lower()
+        if self.normalization == 'nfkc_casefold':
+            value = unicodedata.normalize('NFKC', value)
+        return _casefold(value)
+
+    def normalize_many(self, values):
+        """Normalizes an iterable of values, e.g. for an ``__in`` query."""
+        normalize = self.normalize
+        return [normalize(value) for value in values]
+
     def to_python(self, value):
-        if value:
-            value = value.lower()
-        return value
+        return self.normalize(value)
 
     def prepare_query_value(self, op, value):
-        value = value.lower() if value else value
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = self.normalize_many(value)
+        else:
+            value = self.normalize(value)
+        # Stored values are normalized too, so the case-insensitive string
+        # operators become exact matches and anchored, case-sensitive
+        # regexes, which can use a plain index.
+        if op in ('exact', 'iexact'):
+            return value
+        if op in ('istartswith', 'iendswith', 'icontains'):
+            op = op[1:]
         return super(LowerStringField, self).prepare_query_value(op, value)
 
 
 class LowerEmailField(LowerStringField):
+    """A :class:`LowerStringField` holding an email address.
+
+    :param validation_cache_size: number of recently validated addresses
+        remembered, so that saving them again skips the validation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.validation_cache = LRUCache(kwargs.pop('validation_cache_size', 1024))
+        super(LowerEmailField, self).__init__(*args, **kwargs)
 
     def validate(self, value):
+        if self.validation_cache.get(value):
+            return
         if not EmailField.EMAIL_REGEX.match(value):
             self.error('Invalid Mail-address: %s' % value)
         super(LowerEmailField, self).validate(value)
+        self.validation_cache.set(value, True)
+
+
+class _EnumChoices(tuple):
+    """Enum members as a tuple, the way mongoengine expects ``choices``, with
+    constant time membership tests."""
+
+    def __new__(cls, members):
+        choices = super(_EnumChoices, cls).__new__(cls, members)
+        choices._members = frozenset(choices)
+        return choices
+
+    def __contains__(self, member):
+        try:
+            return member in self._members
+        except TypeError:
+            return False
 
 
-class EnumField(object):
+class EnumField(LazyConversionMixin):
     """
     A class to register Enum type (from the package enum34) into mongo
 
     :param choices: must be of :class:`enum.Enum`: type
         and will be used as possible choices
+    :param lazy: defer the conversion of loaded values to the first
+        attribute access, see :class:`LazyConversionMixin`
     """
 
     def __init__(self, enum, *args, **kwargs):
         self.enum = enum
-        kwargs['choices'] = [choice for choice in enum]
+        # Lookup tables for the hot paths, built once per field.
+        self._members_by_value = dict((member.value, member) for member in enum)
+        self._values_by_member = dict((member, member.value) for member in enum)
+        kwargs['choices'] = _EnumChoices(enum)
         super(EnumField, self).__init__(*args, **kwargs)
 
     def __get_value(self, enum):
-        return enum.value if hasattr(enum, 'value') else enum
+        if enum.__class__ is LazyValue:
+            enum = self._members_by_value.get(enum.raw, enum.raw)
+        try:
+            return self._values_by_member[enum]
+        except (KeyError, TypeError):
+            return enum
+
+    def __get_member(self, value):
+        try:
+            return self._members_by_value[value]
+        except (KeyError, TypeError):
+            # Raises ValueError for values that aren't part of the enum.
+            return self.enum(value)
 
     def to_python(self, value):
-        return self.enum(super(EnumField, self).to_python(value))
+        if value.__class__ is LazyValue:
+            value = value.raw
+        elif isinstance(value, self.enum):
+            return value
+        elif self._defers():
+            return LazyValue(value)
+        try:
+            return self._members_by_value[value]
+        except (KeyError, TypeError):
+            return self.enum(super(EnumField, self).to_python(value))
 
     def to_mongo(self, value):
         return self.__get_value(value)
 
     def prepare_query_value(self, op, value):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            if op in ('in', 'nin', 'all'):
+                return self.query_values(value)
+            return [self.prepare_query_value(op, v) for v in value]
         return super(EnumField, self).prepare_query_value(
                 op, self.__get_value(value))
 
+    def query_values(self, values):
+        """Converts a collection of members (or values) for ``__in``,
+        ``__nin`` or ``__all`` in one pass, deduplicated and sorted so that
+        equal filters always produce the same query shape (and hit the query
+        plan cache). mongoengine prepares these operators one element at a
+        time, so pass the result rather than the members::
+
+            Order.objects(status__in=Order.status.query_values(statuses))
+        """
+        to_mongo = self.to_mongo
+        stored = set(to_mongo(value) for value in values)
+        try:
+            return sorted(stored)
+        except TypeError:
+            return list(stored)
+
     def validate(self, value):
         return super(EnumField, self).validate(self.__get_value(value))
 
     def _validate(self, value, **kwargs):
         return super(EnumField, self)._validate(
-                self.enum(self.__get_value(value)), **kwargs)
+                self.__get_member(self.__get_value(value)), **kwargs)
 
 
 class IntEnumField(EnumField, IntField):
@@ -170,5 +716,86 @@ class IntEnumField(EnumField, IntField):
 
 class StringEnumField(EnumField, StringField):
     """A variation on :class:`EnumField` for only string containing enumeration.
+
+    :param codes: optional ``{member: code}`` table enabling compact
+        storage: every member is stored as its code (a small integer or a
+        short string) instead of its value. The table must cover all
+        members and is part of the data format, so codes must never be
+        changed or reused. Documents that still hold values are read
+        transparently, :meth:`compact_collection` rewrites them.
+    :param match_legacy: with ``codes``, make queries also match documents
+        that still store values (default ``True``). Equality filters become
+        ``{'$in': [code, value]}`` and :meth:`query_values` returns both the
+        codes and the values, so pass its result to ``__in``/``__nin``
+        (members given to them directly are matched by code only). Other
+        operators, unique indexes and ``$ne`` only see codes, so set this to
+        ``False`` once :meth:`compact_collection` has converted every
+        document, which also lets equality filters use the index again.
     """
-    pass
+
+    def __init__(self, enum, *args, **kwargs):
+        self.codes = kwargs.pop('codes', None)
+        self.match_legacy = kwargs.pop('match_legacy', True)
+        super(StringEnumField, self).__init__(enum, *args, **kwargs)
+        if self.codes is None:
+            return
+        missing = set(enum) - set(self.codes)
+        if missing:
+            raise ValueError('No code declared for %s' %
+                             ', '.join(sorted(member.name for member in missing)))
+        members_by_code = dict((code, member)
+                               for member, code in self.codes.items())
+        if len(members_by_code) != len(self.codes):
+            raise ValueError('Enum codes must be unique')
+        if set(members_by_code) & set(self._members_by_value):
+            raise ValueError('Enum codes must differ from the enum values')
+        self._codes_by_value = dict((member.value, code)
+                                    for member, code in self.codes.items())
+        # Codes resolve through the same table as (not yet compacted) values.
+        self._members_by_value.update(members_by_code)
+
+    def to_mongo(self, value):
+        value = super(StringEnumField, self).to_mongo(value)
+        if self.codes is None:
+            return value
+        return self._codes_by_value.get(value, value)
+
+    def prepare_query_value(self, op, value):
+        if self.codes is None or isinstance(value, (list, tuple, set, frozenset)):
+            return super(StringEnumField, self).prepare_query_value(op, value)
+        if op in ('in', 'nin') and self.match_legacy and value in self._members_by_value:
+            # An element of query_values(), codes and values alike.
+            return value
+        code = self.to_mongo(value)
+        if op is None and self.match_legacy and code in self._members_by_value:
+            return {'$in': [code, self._members_by_value[code].value]}
+        return code
+
+    def query_values(self, values):
+        stored = super(StringEnumField, self).query_values(values)
+        if self.codes is None or not self.match_legacy:
+            return stored
+        legacy = sorted(set(self._members_by_value[code].value
+                            for code in stored if code in self._members_by_value))
+        return stored + legacy
+
+    def compact_collection(self, document=None, batch_size=1000):
+        """Rewrites the documents that still store enum values with their
+        codes, ``batch_size`` documents at a time. Returns the number of
+        documents converted.
+        """
+        if self.codes is None:
+            raise ValueError('%s has no codes to compact to' % self.name)
+        document = document or self.owner_document
+        id_field = document._meta['id_field']
+        legacy = {self.db_field: {'$in': list(self._codes_by_value)}}
+        converted = 0
+        while True:
+            ids = list(document.objects(__raw__=legacy)
+                       .limit(batch_size).scalar(id_field))
+            if not ids:
+                return converted
+            for member in self.enum:
+                converted += document.objects(__raw__={
+                    '_id': {'$in': ids}, self.db_field: member.value,
+                }).update(**{'set__%s' % self.name: member})
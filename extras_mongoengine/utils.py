@@ -9,21 +9,75 @@ from django.utils import six
 
 from mongoengine import signals
 from mongoengine.base import TopLevelDocumentMetaclass
+from mongoengine.base.common import _document_registry
 
-import imp
+import json
 import sys
 import os
-from inspect import isclass
+import tempfile
+import threading
 
+if six.PY2:
+    from imp import lock_held as _import_lock_held
+    # There's a single import lock, it can't deadlock.
+    _DeadlockError = ()
+else:
+    from _imp import lock_held as _import_lock_held
+    from importlib._bootstrap import _DeadlockError
 
-__all__ = ('get_apps', 'get_app', 'get_documents', 'get_document', 'register_documents',
-        'load_app', 'app_cache_ready', 'get_app_label')
+
+__all__ = ('get_apps', 'get_app', 'get_documents', 'iter_documents', 'get_document',
+        'register_documents', 'load_app', 'app_cache_ready', 'get_app_label')
+
+
+# Bumped whenever the format of the AppCache snapshot changes.
+SNAPSHOT_VERSION = 1
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def _source_path(path):
+    # Compiled files are rewritten more often than their sources change.
+    base, ext = os.path.splitext(upath(path))
+    if ext in ('.pyc', '.pyo') and os.path.exists(base + '.py'):
+        return base + '.py'
+    return upath(path)
+
+
+def _label_for_module(module_name):
+    parts = module_name.split('.')
+    return parts[-2] if len(parts) > 1 else parts[0]
 
 
 def get_app_label(document):
     if not document:
         return ''
-    return document.__module__.split('.')[-2]
+    try:
+        return cache.document_labels[document]
+    except KeyError:
+        return _label_for_module(document.__module__)
+
+
+class _AppLoading(object):
+    """
+    The loading of an app by a thread, a future for its documents module.
+    Other threads wait for ``event`` and then read ``module`` or re-raise
+    ``error`` instead of loading the app again. ``done`` is False when the
+    app was postponed.
+    """
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.event = threading.Event()
+        self.module = None
+        self.error = None
+        self.done = False
 
 
 class AppCache(object):
@@ -47,18 +101,54 @@ class AppCache(object):
         # Mapping of app_labels to errors raised when trying to import the app.
         app_errors={},
 
+        # Documents indexed when their class is created: module names to
+        # {lowercased document name: document}, and documents to app_labels.
+        module_documents={},
+        document_labels={},
+
         # -- Everything below here is only used when populating the cache --
         loaded=False,#yes
         handled=set(),#yes
         postponed=[],#yes
-        nesting_level=0,#yes
         _get_documents_cache={},#yes
+        # The results of get_documents() filtered by available_apps, valid
+        # until available_apps or the documents change.
+        _available_documents_cache={},
         available_apps=None,#yes
+
+        # Whether apps are loaded one at a time, when a lookup needs them,
+        # instead of all at once (the EXTRAS_MONGOENGINE_LAZY_APPS setting).
+        lazy=None,
+
+        # Guards the state above. It's never held while importing, so that a
+        # thread importing an app can't deadlock with one waiting for the
+        # cache (see #18251); threads rather wait for the _AppLoading of the
+        # app they need, unless they may hold import locks (see _importing).
+        _lock=threading.RLock(),
+        # Mapping of app names to their _AppLoading.
+        _loading={},
+        # Holds the nesting_level of each thread.
+        _local=threading.local(),
+
+        # The snapshot read from the EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT
+        # file, if it's still valid: {'labels': {app_label: set of lowercased
+        # document names}, 'no_models': set of app names without models}.
+        snapshot=None,
+        _snapshot_checked=False,
     )
 
     def __init__(self):
         self.__dict__ = self.__shared_state
 
+    @property
+    def nesting_level(self):
+        """How many apps the current thread is loading, one inside another."""
+        return getattr(self._local, 'nesting_level', 0)
+
+    @nesting_level.setter
+    def nesting_level(self, value):
+        self._local.nesting_level = value
+
     def _populate(self):
         """
         Fill in all the cache information. This method is threadsafe, in the
@@ -67,26 +157,146 @@ class AppCache(object):
         """
         if self.loaded:
             return
-        # Note that we want to use the import lock here - the app loading is
-        # in many cases initiated implicitly by importing, and thus it is
-        # possible to end up in deadlock when one thread initiates loading
-        # without holding the importer lock and another thread then tries to
-        # import something which also launches the app loading. For details of
-        # this situation see #18251.
-        imp.acquire_lock()
+        snapshot = self._get_snapshot()
+        for app_name in settings.INSTALLED_APPS:
+            if snapshot is not None and app_name in snapshot['no_models']:
+                continue
+            self._ensure_app(app_name, True)
+        if not self.nesting_level:
+            for app_name in list(self.postponed):
+                self.load_app(app_name)
+            self._set_loaded()
+
+    def _set_loaded(self):
+        """
+        Marks the cache as fully populated and, unless a valid snapshot was
+        read, writes the EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT file.
+        """
+        with self._lock:
+            self.loaded = True
+        if self._get_snapshot() is None and self._snapshot_path():
+            try:
+                self.save_snapshot()
+            except (IOError, OSError):
+                pass
+
+    def _snapshot_path(self):
+        return getattr(settings, 'EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT', None)
+
+    def _get_snapshot(self):
+        if not self._snapshot_checked:
+            with self._lock:
+                if not self._snapshot_checked:
+                    path = self._snapshot_path()
+                    self.snapshot = self._read_snapshot(path) if path else None
+                    self._snapshot_checked = True
+        return self.snapshot
+
+    def _read_snapshot(self, path):
+        """
+        Returns the snapshot written by save_snapshot() to ``path``, or None
+        if it's missing or stale: INSTALLED_APPS changed, or the source file
+        of a models module (or the directory of an app without one) has a
+        different mtime or size.
+        """
         try:
-            if self.loaded:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if (data.get('version') != SNAPSHOT_VERSION
+                or data.get('installed_apps') != list(settings.INSTALLED_APPS)):
+            return None
+        for app in data['apps']:
+            if app['stamp'] is None or _file_stamp(app['path']) != app['stamp']:
+                return None
+        return {
+            'labels': dict((app['label'], set(app['documents']))
+                           for app in data['apps'] if 'label' in app),
+            'no_models': set(app['name'] for app in data['apps']
+                             if 'label' not in app),
+        }
+
+    def save_snapshot(self, path=None):
+        """
+        Writes the resolved state of the cache (app labels, models modules,
+        document names and the mtime and size of their source files) to
+        ``path``, by default the EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT
+        setting. While the snapshot is valid, later processes don't try to
+        import the models of apps that have none, and get_document() only
+        imports the app it's asked about.
+        """
+        path = path or self._snapshot_path()
+        self._populate()
+        apps = []
+        for app_name in settings.INSTALLED_APPS:
+            app_module = sys.modules.get(app_name)
+            documents = sys.modules.get('%s.models' % app_name)
+            if documents is None or documents not in self.app_store:
+                app_path = getattr(app_module, '__file__', None)
+                if app_path is not None:
+                    app_path = os.path.dirname(upath(app_path))
+                apps.append({
+                    'name': app_name,
+                    'path': app_path,
+                    'stamp': _file_stamp(app_path),
+                })
+            else:
+                app_label = self._label_for(documents)
+                documents_path = _source_path(documents.__file__)
+                apps.append({
+                    'name': app_name,
+                    'label': app_label,
+                    'module': documents.__name__,
+                    'documents': list(self.app_documents.get(app_label, ())),
+                    'path': documents_path,
+                    'stamp': _file_stamp(documents_path),
+                })
+        data = {
+            'version': SNAPSHOT_VERSION,
+            'installed_apps': list(settings.INSTALLED_APPS),
+            'apps': apps,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+
+    def _ensure_app(self, app_name, can_postpone=False):
+        """
+        Loads the app unless it has been handled already, waiting for it if
+        another thread is loading it. An app being loaded by the current
+        thread (i.e. whose import triggered this call) is skipped.
+        """
+        loading = self._loading.get(app_name)
+        if loading is None or loading.thread is not threading.current_thread():
+            self.load_app(app_name, can_postpone)
+
+    def _importing(self):
+        """
+        Whether the current thread may hold import locks: it's importing an
+        app, or the interpreter's import lock is held (on Python 2 it's held
+        for the whole import). Waiting for another thread loading an app
+        could then deadlock, if that thread needs one of those locks.
+        """
+        return self.nesting_level > 0 or _import_lock_held()
+
+    def _is_lazy(self):
+        if self.lazy is None:
+            self.lazy = getattr(settings, 'EXTRAS_MONGOENGINE_LAZY_APPS', False)
+        return self.lazy
+
+    def _load_app_named(self, predicate):
+        """
+        Loads the first installed app whose name matches ``predicate``, if it
+        hasn't been loaded yet, without populating the whole cache.
+        """
+        if self.loaded:
+            return
+        for app_name in settings.INSTALLED_APPS:
+            if predicate(app_name):
+                self._ensure_app(app_name)
                 return
-            for app_name in settings.INSTALLED_APPS:
-                if app_name in self.handled:
-                    continue
-                self.load_app(app_name, True)
-            if not self.nesting_level:
-                for app_name in self.postponed:
-                    self.load_app(app_name)
-                self.loaded = True
-        finally:
-            imp.release_lock()
 
     def _label_for(self, app_mod):
         """
@@ -94,51 +304,96 @@ class AppCache(object):
         """
         return app_mod.__name__.split('.')[-2]
 
-    def _find_documents_for(self, app_mod):
-        app_documents = SortedDict()
-        for value in dir(app_mod):
-            if value.startswith('_'):
-                continue
-
-            cls = getattr(app_mod, value)
-            if not isclass(cls):
-                continue
-
-            if not isinstance(cls, TopLevelDocumentMetaclass):
-                continue
-
-            document_name = cls.__name__
-
-            if document_name in ('Document', 'EmbeddedDocument', 'DynamicDocument'):
-                continue
-
-            # The same document may be imported via different paths (e.g.
-            # appname.models and project.appname.models). We use the source
-            # filename as a means to detect identity.
-            fname1 = os.path.abspath(upath(sys.modules[cls.__module__].__file__))
-            fname2 = os.path.abspath(upath(app_mod.__file__))
-            # Since the filename extension could be .py the first time and
-            # .pyc or .pyo the second time, ignore the extension when
-            # comparing.
-            if os.path.splitext(fname1)[0] != os.path.splitext(fname2)[0]:
-                continue
-
-            app_documents[document_name.lower()] = cls
+    def _index_document(self, document):
+        """
+        Indexes a document class by its module as soon as it's created (see
+        _install_document_hook), so that loading an app doesn't have to scan
+        its module.
+        """
+        document_name = document.__name__
+        if document_name in ('Document', 'EmbeddedDocument', 'DynamicDocument'):
+            return
+        module_name = document.__module__
+        app_label = _label_for_module(module_name)
+        with self._lock:
+            self.module_documents.setdefault(
+                module_name, SortedDict())[document_name.lower()] = document
+            self.document_labels[document] = app_label
+            # Documents created after their app has been loaded.
+            app_mod = self.app_labels.get(app_label)
+            if app_mod is not None and app_mod.__name__ == module_name:
+                self.app_documents.setdefault(
+                    app_label, SortedDict())[document_name.lower()] = document
+                self._clear_documents_cache()
+
+    def _clear_documents_cache(self):
+        self._get_documents_cache.clear()
+        self._available_documents_cache.clear()
 
-        return app_documents
+    def _find_documents_for(self, app_mod):
+        return SortedDict(self.module_documents.get(app_mod.__name__, ()))
 
     def load_app(self, app_name, can_postpone=False):
         """
         Loads the app with the provided fully qualified name, and returns the
-        document module.
+        document module. If another thread is loading the app, waits for it
+        and returns its result instead.
         """
-        self.handled.add(app_name)
+        while True:
+            loading = self._loading.get(app_name)
+            if loading is not None and loading.done:
+                return loading.module
+            with self._lock:
+                loading = self._loading.get(app_name)
+                if loading is None:
+                    loading = self._loading[app_name] = _AppLoading()
+                    self.handled.add(app_name)
+                    break
+            if (loading.thread is threading.current_thread()
+                    or self._importing()):
+                # Re-entrant loading, the documents module may be partially
+                # imported; or the owner may need an import lock held by
+                # this thread. The import locks sort it out, as they did
+                # before.
+                return self._load_app(app_name, can_postpone)
+            loading.event.wait()
+            if loading.error is not None:
+                six.reraise(*loading.error)
+            if loading.done:
+                return loading.module
+            # The app was postponed: try again.
+        try:
+            loading.module = self._load_app(app_name, can_postpone)
+            loading.done = (loading.module is not None
+                            or app_name not in self.postponed)
+            return loading.module
+        except BaseException:
+            loading.error = sys.exc_info()
+            raise
+        finally:
+            if not loading.done:
+                # Postponed or failed, the next caller loads it again.
+                with self._lock:
+                    if self._loading.get(app_name) is loading:
+                        del self._loading[app_name]
+            loading.event.set()
+
+    def _load_app(self, app_name, can_postpone):
         self.nesting_level += 1
-        app_module = import_module(app_name)
         try:
-            documents = import_module('%s.models' % app_name)
-        except ImportError:
+            app_module = import_module(app_name)
+            try:
+                documents = import_module('%s.models' % app_name)
+            except _DeadlockError:
+                # Imported by a thread waiting for this one: take the
+                # partially imported module, as the import system does.
+                documents = sys.modules['%s.models' % app_name]
+            except ImportError:
+                documents = None
+                error = sys.exc_info()
+        finally:
             self.nesting_level -= 1
+        if documents is None:
             # If the app doesn't have a documents module, we can just ignore the
             # ImportError and return no documents for it.
             if not module_has_submodule(app_module, 'models'):
@@ -152,16 +407,26 @@ class AppCache(object):
             # then it's time to raise the ImportError.
             else:
                 if can_postpone:
-                    self.postponed.append(app_name)
+                    with self._lock:
+                        if app_name not in self.postponed:
+                            self.postponed.append(app_name)
                     return None
                 else:
-                    raise
+                    six.reraise(*error)
 
-        self.nesting_level -= 1
-        if documents not in self.app_store:
-            self.app_store[documents] = len(self.app_store)
-            self.app_labels[self._label_for(documents)] = documents
-            self.app_documents[self._label_for(documents)] = self._find_documents_for(documents)
+        with self._lock:
+            if documents not in self.app_store:
+                self.app_store[documents] = len(self.app_store)
+                self.app_labels[self._label_for(documents)] = documents
+                self.app_documents[self._label_for(documents)] = self._find_documents_for(documents)
+            else:
+                # It may have been registered partially imported.
+                app_documents = self.app_documents.setdefault(
+                    self._label_for(documents), SortedDict())
+                for name, document in self._find_documents_for(documents).items():
+                    if name not in app_documents:
+                        app_documents[name] = document
+                        self._clear_documents_cache()
         return documents
 
     def app_cache_ready(self):
@@ -213,20 +478,17 @@ class AppCache(object):
         Raises UnavailableApp when set_available_apps() in in effect and
         doesn't include app_label.
         """
-        self._populate()
-        imp.acquire_lock()
-        try:
-            for app_name in settings.INSTALLED_APPS:
-                if app_label == app_name.split('.')[-1]:
-                    mod = self.load_app(app_name, False)
-                    if mod is None and not emptyOK:
-                        raise ImproperlyConfigured("App with label %s is missing a models.py module." % app_label)
-                    if self.available_apps is not None and app_label not in self.available_apps:
-                        raise UnavailableApp("App with label %s isn't available." % app_label)
-                    return mod
-            raise ImproperlyConfigured("App with label %s could not be found" % app_label)
-        finally:
-            imp.release_lock()
+        if not self._is_lazy():
+            self._populate()
+        for app_name in settings.INSTALLED_APPS:
+            if app_label == app_name.split('.')[-1]:
+                mod = self.load_app(app_name, False)
+                if mod is None and not emptyOK:
+                    raise ImproperlyConfigured("App with label %s is missing a models.py module." % app_label)
+                if self.available_apps is not None and app_label not in self.available_apps:
+                    raise UnavailableApp("App with label %s isn't available." % app_label)
+                return mod
+        raise ImproperlyConfigured("App with label %s could not be found" % app_label)
 
     def get_app_errors(self):
         "Returns the map of known problems with the INSTALLED_APPS."
@@ -251,16 +513,32 @@ class AppCache(object):
         include_swapped, they will be.
         """
         cache_key = (app_mod, only_installed)
-        document_list = None
+        filtered = self.available_apps is not None and only_installed
         try:
-            document_list = self._get_documents_cache[cache_key]
-            if self.available_apps is not None and only_installed:
-                document_list = [d for d in document_list
-                                if get_app_label(d) in self.available_apps]
-            return document_list
+            if filtered:
+                return self._available_documents_cache[cache_key]
+            return self._get_documents_cache[cache_key]
         except KeyError:
             pass
-        self._populate()
+        try:
+            document_list = self._get_documents_cache[cache_key]
+        except KeyError:
+            document_list = self._list_documents(app_mod, only_installed)
+            self._get_documents_cache[cache_key] = document_list
+        if filtered:
+            available_apps = self.available_apps
+            document_list = [d for d in document_list
+                            if get_app_label(d) in available_apps]
+            if self.available_apps is available_apps:
+                self._available_documents_cache[cache_key] = document_list
+        return document_list
+
+    def _list_documents(self, app_mod, only_installed):
+        if app_mod and self._is_lazy():
+            package = app_mod.__name__.rpartition('.')[0]
+            self._load_app_named(lambda app_name: app_name == package)
+        else:
+            self._populate()
         if app_mod:
             if app_mod in self.app_store:
                 app_list = [self.app_documents.get(self._label_for(app_mod),
@@ -278,12 +556,33 @@ class AppCache(object):
             document_list.extend(
                 document for document in app.values()
             )
-        self._get_documents_cache[cache_key] = document_list
-        if self.available_apps is not None and only_installed:
-            document_list = [d for d in document_list
-                            if get_app_label(d) in self.available_apps]
         return document_list
 
+    def iter_documents(self, only_installed=True):
+        """
+        Yields the installed documents app by app, loading each app only when
+        the documents of the previous one have been consumed. The documents of
+        apps that were only registered (see register_documents) come last
+        when only_installed is False.
+        """
+        for app_name in settings.INSTALLED_APPS:
+            app_mod = self.load_app(app_name)
+            if app_mod is None:
+                continue
+            app_label = self._label_for(app_mod)
+            if (self.available_apps is not None and only_installed
+                    and app_label not in self.available_apps):
+                continue
+            for document in list(self.app_documents.get(app_label, {}).values()):
+                yield document
+        if not self.loaded and not self.nesting_level and not self.postponed:
+            self._set_loaded()
+        if not only_installed:
+            for app_label, documents in list(self.app_documents.items()):
+                if app_label not in self.app_labels:
+                    for document in list(documents.values()):
+                        yield document
+
     def get_document(self, app_label, document_name,
                   seed_cache=True, only_installed=True):
         """
@@ -293,8 +592,18 @@ class AppCache(object):
         Raises UnavailableApp when set_available_apps() in in effect and
         doesn't include app_label.
         """
+        if seed_cache and only_installed and not self.loaded:
+            snapshot = self._get_snapshot()
+            if snapshot is not None and app_label not in snapshot['labels']:
+                return None
+        else:
+            snapshot = None
         if seed_cache:
-            self._populate()
+            if self._is_lazy() or snapshot is not None:
+                self._load_app_named(
+                    lambda app_name: app_name.split('.')[-1] == app_label)
+            else:
+                self._populate()
         if only_installed and app_label not in self.app_labels:
             return None
         if (self.available_apps is not None and only_installed
@@ -326,7 +635,7 @@ class AppCache(object):
                 if os.path.splitext(fname1)[0] == os.path.splitext(fname2)[0]:
                     continue
             document_dict[document_name] = document
-        self._get_documents_cache.clear()
+        self._clear_documents_cache()
 
     def set_available_apps(self, available):
         if not set(available).issubset(set(settings.INSTALLED_APPS)):
@@ -334,12 +643,48 @@ class AppCache(object):
             raise ValueError("Available apps isn't a subset of installed "
                 "apps, extra apps: " + ", ".join(extra))
         self.available_apps = set(app.rsplit('.', 1)[-1] for app in available)
+        self._available_documents_cache.clear()
 
     def unset_available_apps(self):
         self.available_apps = None
+        self._available_documents_cache.clear()
 
 cache = AppCache()
 
+
+def _install_document_hook():
+    """
+    Wraps TopLevelDocumentMetaclass.__new__ to index every document class
+    in the AppCache, and indexes the documents created before. Idempotent.
+
+    mongoengine's registry only keeps the last document of each name, so
+    the models modules imported before are scanned as well: two apps may
+    both define e.g. a ``Profile``.
+    """
+    metaclass_new = TopLevelDocumentMetaclass.__new__
+    if getattr(metaclass_new, 'indexes_app_cache', False):
+        return
+
+    def __new__(mcs, name, bases, attrs):
+        document = metaclass_new(mcs, name, bases, attrs)
+        cache._index_document(document)
+        return document
+    __new__.indexes_app_cache = True
+    TopLevelDocumentMetaclass.__new__ = staticmethod(__new__)
+
+    for document in list(_document_registry.values()):
+        if isinstance(document, TopLevelDocumentMetaclass):
+            cache._index_document(document)
+    for module_name, module in list(sys.modules.items()):
+        if module is None or module_name.rsplit('.', 1)[-1] != 'models':
+            continue
+        for value in list(vars(module).values()):
+            if (isinstance(value, TopLevelDocumentMetaclass)
+                    and value.__module__ == module_name):
+                cache._index_document(value)
+
+_install_document_hook()
+
 # These methods were always module level, so are kept that way for backwards
 # compatibility.
 get_apps = cache.get_apps
@@ -347,6 +692,7 @@ get_app_paths = cache.get_app_paths
 get_app = cache.get_app
 get_app_errors = cache.get_app_errors
 get_documents = cache.get_documents
+iter_documents = cache.iter_documents
 get_document = cache.get_document
 register_documents = cache.register_documents
 load_app = cache.load_app
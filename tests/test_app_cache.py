@@ -0,0 +1,321 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+from django.test.utils import override_settings
+
+from mongoengine import Document, StringField
+
+from extras_mongoengine.utils import AppCache, get_app_label
+
+
+PROFILE = '''
+from mongoengine import Document, StringField
+
+class Profile(Document):
+    name = StringField()
+'''
+
+SLOW = '''
+import time
+time.sleep(0.1)
+'''
+
+BROKEN = SLOW + '''
+raise ValueError('broken')
+'''
+
+NEEDS = '''
+import time
+from %(hook)s import cache
+time.sleep(0.1)
+cache.load_app(%(other)r)
+'''
+
+GETS = '''
+import time
+from %(hook)s import cache
+time.sleep(0.2)
+cache.get_app(%(other)r)
+'''
+
+IMPORTS = '''
+import %(other)s.models
+'''
+
+_prefixes = itertools.count()
+
+
+class AppCacheTestCase(unittest.TestCase):
+    """
+    Builds throwaway apps in a temporary directory, like
+    benchmarks/bench_app_cache.py, and looks them up with an AppCache of
+    their own.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        sys.path.insert(0, self.tmpdir)
+        self.prefix = 'appcachetest%d' % next(_prefixes)
+        self.apps = itertools.count()
+        self.snapshot = os.path.join(self.tmpdir, 'snapshot.json')
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        self.unimport()
+        shutil.rmtree(self.tmpdir)
+
+    def make_app(self, source=None):
+        """Creates an app, with a models module holding ``source``."""
+        name = '%s_%d' % (self.prefix, next(self.apps))
+        os.mkdir(os.path.join(self.tmpdir, name))
+        open(os.path.join(self.tmpdir, name, '__init__.py'), 'w').close()
+        if source is not None:
+            self.write(name, source)
+        return name
+
+    def write(self, app_name, source, mode='w'):
+        with open(os.path.join(self.tmpdir, app_name, 'models.py'), mode) as f:
+            f.write(source)
+
+    def make_hook(self, cache):
+        """Creates a module through which models modules reach ``cache``."""
+        name = '%s_hook' % self.prefix
+        with open(os.path.join(self.tmpdir, name + '.py'), 'w') as f:
+            f.write('cache = None\n')
+        __import__(name)
+        sys.modules[name].cache = cache
+        return name
+
+    def install(self, *app_names, **options):
+        override = override_settings(INSTALLED_APPS=list(app_names), **options)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_cache(self):
+        """
+        Returns an AppCache with a state of its own, sharing only the index
+        of documents that the metaclass hook fills in.
+        """
+        cache = AppCache.__new__(AppCache)
+        state = {}
+        for key, value in AppCache._AppCache__shared_state.items():
+            if key in ('module_documents', 'document_labels'):
+                state[key] = value
+            elif isinstance(value, (dict, list, set)):
+                state[key] = type(value)()
+            else:
+                state[key] = None
+        state.update(_lock=threading.RLock(), _local=threading.local(),
+                     loaded=False, _snapshot_checked=False)
+        cache.__dict__ = state
+        return cache
+
+    def imported(self):
+        return sorted(name for name in sys.modules
+                      if name.startswith(self.prefix + '_'))
+
+    def unimport(self):
+        """Forgets the apps' modules, as a new process would."""
+        for name in list(sys.modules):
+            if name.startswith(self.prefix + '_'):
+                del sys.modules[name]
+
+    def run_threads(self, *targets):
+        results = [None] * len(targets)
+
+        def run(i, target):
+            try:
+                results[i] = target()
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i, target))
+                   for i, target in enumerate(targets)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), 'Deadlocked')
+        return results
+
+    def test_same_named_documents_of_two_apps(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second)
+        cache = self.make_cache()
+        profile = cache.get_document(first, 'profile')
+        other = cache.get_document(second, 'Profile')
+        self.assertEqual(profile.__module__, '%s.models' % first)
+        self.assertEqual(other.__module__, '%s.models' % second)
+        self.assertEqual(get_app_label(profile), first)
+        self.assertEqual(get_app_label(other), second)
+        self.assertEqual(cache.get_documents(), [profile, other])
+
+    def test_lazy_get_document(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second, EXTRAS_MONGOENGINE_LAZY_APPS=True)
+        cache = self.make_cache()
+        self.assertIsNotNone(cache.get_document(second, 'profile'))
+        self.assertEqual(self.imported(), [second, '%s.models' % second])
+        self.assertFalse(cache.loaded)
+        self.assertIsNone(cache.get_document(first, 'missing'))
+        self.assertIn('%s.models' % first, sys.modules)
+
+    def test_iter_documents(self):
+        first = self.make_app(PROFILE)
+        empty = self.make_app()
+        second = self.make_app(PROFILE)
+        self.install(first, empty, second)
+        cache = self.make_cache()
+        documents = cache.iter_documents()
+        self.assertEqual(get_app_label(next(documents)), first)
+        self.assertNotIn(second, sys.modules)
+        self.assertEqual([get_app_label(d) for d in documents], [second])
+        self.assertTrue(cache.loaded)
+
+    def test_iter_documents_saves_the_snapshot(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second,
+                     EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT=self.snapshot)
+        cache = self.make_cache()
+        self.assertEqual(len(list(cache.iter_documents())), 2)
+        self.assertTrue(cache.loaded)
+        self.unimport()
+        self.assertIsNotNone(self.make_cache()._get_snapshot())
+
+    def test_concurrent_loading_shares_the_module(self):
+        app = self.make_app(SLOW + PROFILE)
+        self.install(app)
+        cache = self.make_cache()
+        load = lambda: cache.load_app(app)
+        first, second = self.run_threads(load, load)
+        self.assertIs(first, sys.modules['%s.models' % app])
+        self.assertIs(second, first)
+        self.assertEqual(len(cache.app_store), 1)
+
+    def test_concurrent_loading_reraises_the_error(self):
+        app = self.make_app(BROKEN)
+        self.install(app)
+        cache = self.make_cache()
+        load = lambda: cache.load_app(app)
+        for error in self.run_threads(load, load):
+            self.assertIsInstance(error, ValueError)
+        self.assertNotIn(app, cache._loading)
+
+    def test_apps_needing_each_other_in_two_threads(self):
+        cache = self.make_cache()
+        hook = self.make_hook(cache)
+        first = '%s_0' % self.prefix
+        second = '%s_1' % self.prefix
+        self.make_app(NEEDS % {'hook': hook, 'other': second} + PROFILE)
+        self.make_app(NEEDS % {'hook': hook, 'other': first} + PROFILE)
+        self.install(first, second)
+        results = self.run_threads(lambda: cache.load_app(first),
+                                   lambda: cache.load_app(second))
+        self.assertEqual([module.__name__ for module in results],
+                         ['%s.models' % first, '%s.models' % second])
+        self.assertIsNotNone(cache.get_document(first, 'profile'))
+        self.assertIsNotNone(cache.get_document(second, 'profile'))
+
+    def test_app_importing_an_app_that_needs_it(self):
+        cache = self.make_cache()
+        hook = self.make_hook(cache)
+        first = '%s_0' % self.prefix
+        second = '%s_1' % self.prefix
+        self.make_app(GETS % {'hook': hook, 'other': second} + PROFILE)
+        self.make_app(IMPORTS % {'other': first} + PROFILE)
+        self.install(first, second, EXTRAS_MONGOENGINE_LAZY_APPS=True)
+
+        def get_second():
+            time.sleep(0.1)
+            return cache.get_app(second)
+        results = self.run_threads(lambda: cache.get_app(first), get_second)
+        self.assertEqual([module.__name__ for module in results],
+                         ['%s.models' % first, '%s.models' % second])
+
+    def test_available_apps_filter_documents(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second)
+        cache = self.make_cache()
+        self.assertEqual(len(cache.get_documents()), 2)
+        cache.set_available_apps([first])
+        documents = cache.get_documents()
+        self.assertEqual([get_app_label(d) for d in documents], [first])
+        self.assertIs(cache.get_documents(), documents)
+        cache.set_available_apps([second])
+        self.assertEqual([get_app_label(d) for d in cache.get_documents()],
+                         [second])
+        cache.unset_available_apps()
+        self.assertEqual(len(cache.get_documents()), 2)
+
+    def test_register_documents_invalidates_filtered_documents(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second)
+        cache = self.make_cache()
+        cache.set_available_apps([first])
+        documents = cache.get_documents()
+        extra = type('Extra', (Document,), {
+            '__module__': '%s.models' % first,
+            'name': StringField(),
+        })
+        cache.register_documents(first, extra)
+        self.assertEqual(cache.get_documents(), documents + [extra])
+
+    def test_snapshot(self):
+        first = self.make_app(PROFILE)
+        empty = self.make_app()
+        second = self.make_app(PROFILE)
+        self.install(first, empty, second,
+                     EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT=self.snapshot)
+        self.make_cache().get_documents()
+        self.assertTrue(os.path.exists(self.snapshot))
+        self.unimport()
+        cache = self.make_cache()
+        self.assertIsNotNone(cache._get_snapshot())
+        self.assertIsNone(cache.get_document('unknown', 'profile'))
+        self.assertIsNone(cache.get_document(empty, 'profile'))
+        self.assertEqual(self.imported(), [])
+        self.assertIsNotNone(cache.get_document(second, 'profile'))
+        self.assertEqual(self.imported(), [second, '%s.models' % second])
+        self.assertFalse(cache.loaded)
+        cache.get_documents()
+        self.assertNotIn(empty, sys.modules)
+
+    def test_snapshot_is_stale_when_a_models_module_changes(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, second,
+                     EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT=self.snapshot)
+        self.make_cache().get_documents()
+        self.unimport()
+        path = os.path.join(self.tmpdir, first, 'models.py')
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+        cache = self.make_cache()
+        self.assertIsNone(cache._get_snapshot())
+        self.assertIsNotNone(cache.get_document(second, 'profile'))
+        self.assertTrue(cache.loaded)
+        self.assertIn('%s.models' % first, sys.modules)
+
+    def test_snapshot_is_stale_when_installed_apps_change(self):
+        first, second = self.make_app(PROFILE), self.make_app(PROFILE)
+        self.install(first, EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT=self.snapshot)
+        self.make_cache().get_documents()
+        self.unimport()
+        self.install(first, second,
+                     EXTRAS_MONGOENGINE_APP_CACHE_SNAPSHOT=self.snapshot)
+        cache = self.make_cache()
+        self.assertIsNone(cache._get_snapshot())
+        self.assertIsNotNone(cache.get_document(second, 'profile'))
+        self.assertTrue(cache.loaded)
@@ -0,0 +1,149 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from bson import ObjectId
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+from mongoengine import connect
+from mongoengine.connection import get_db
+
+from extras_mongoengine.cache import (CacheInvalidation, CacheNamespace,
+    DjangoCacheBackend, InvalidationWatcher, LocalMemoryBackend,
+    SharedFileBackend)
+
+
+class CacheNamespaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='extrasmongoenginetest')
+        self.db = get_db()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        for collection in self.db.collection_names():
+            if 'system.' in collection:
+                continue
+            self.db.drop_collection(collection)
+
+    def test_local_namespace(self):
+        cache = CacheNamespace('test', backend=LocalMemoryBackend())
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        self.assertRaises(KeyError, lambda: cache['b'])
+        cache.clear()
+        self.assertNotIn('a', cache)
+
+    def test_shared_file_backend(self):
+        path = os.path.join(self.tmpdir, 'cache')
+        first = CacheNamespace('test', backend=SharedFileBackend(path))
+        second = CacheNamespace('test', backend=SharedFileBackend(path))
+        first['a'] = {'domain': 'example.com'}
+        self.assertEqual(second['a'], {'domain': 'example.com'})
+        second.invalidate('a')
+        self.assertNotIn('a', first)
+
+    def test_shared_file_backend_prunes_old_generations(self):
+        backend = SharedFileBackend(os.path.join(self.tmpdir, 'cache'))
+        cache = CacheNamespace('test', backend=backend, check_interval=0)
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(cache['b'], 2)
+        cache.clear()
+        cache['c'] = 3
+        self.assertEqual([key[2] for key in backend._load()], ['c'])
+
+    def test_django_cache_backend(self):
+        cache = CacheNamespace('test', backend=DjangoCacheBackend(),
+                               check_interval=0)
+        # Keys of the ContentType cache are tuples.
+        cache[('app', 'document')] = 1
+        cache.set_many({'a': 2, ('app', 'other'): 3})
+        self.assertEqual(cache[('app', 'document')], 1)
+        self.assertEqual(cache['a'], 2)
+        self.assertEqual(cache[('app', 'other')], 3)
+        cache.invalidate(('app', 'document'))
+        self.assertNotIn(('app', 'document'), cache)
+        cache.clear()
+        self.assertNotIn('a', cache)
+
+    def test_unclearable_backend_needs_check_interval(self):
+        class Backend(LocalMemoryBackend):
+            clearable = False
+        self.assertRaises(ValueError, CacheNamespace, 'test', Backend())
+
+    def test_generation_reaches_other_processes(self):
+        # Two namespaces with separate local backends stand in for two
+        # processes.
+        first = CacheNamespace('test', LocalMemoryBackend(), check_interval=0)
+        second = CacheNamespace('test', LocalMemoryBackend(), check_interval=0)
+        first['a'] = 1
+        second['a'] = 1
+        first.invalidate('a')
+        self.assertNotIn('a', first)
+        self.assertNotIn('a', second)
+
+    def test_broadcast_reaches_other_processes(self):
+        first = CacheNamespace('test', LocalMemoryBackend(), broadcast=True)
+        second = CacheNamespace('test', LocalMemoryBackend(), broadcast=True)
+        watcher = InvalidationWatcher()
+        first[('a', 1)] = 1
+        second[('a', 1)] = 1
+        second['b'] = 2
+        first.invalidate(('a', 1))
+        self.assertNotIn(('a', 1), first)
+        self.assertEqual(watcher.poll(), 1)
+        self.assertNotIn(('a', 1), second)
+        self.assertEqual(second['b'], 2)
+        self.assertEqual(watcher.poll(), 0)
+
+
+    def test_watcher_follows_insertion_order(self):
+        cache = CacheNamespace('test', LocalMemoryBackend(), broadcast=True)
+        collection = CacheInvalidation._get_collection()
+        collection.insert_one({'_id': ObjectId('0' * 23 + '2'),
+                               'namespace': 'other', 'keys': []})
+        watcher = InvalidationWatcher()
+        cache['a'] = 1
+        # Published later by a process whose ObjectIds sort lower.
+        collection.insert_one({'_id': ObjectId('0' * 23 + '1'),
+                               'namespace': 'test', 'keys': ['a']})
+        self.assertEqual(watcher.poll(), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(watcher.poll(), 0)
+
+    def test_watcher_survives_errors(self):
+        class Backend(LocalMemoryBackend):
+            fail = True
+
+            def delete(self, key):
+                if self.fail:
+                    self.fail = False
+                    raise ValueError('backend error')
+                super(Backend, self).delete(key)
+
+        cache = CacheNamespace('test', Backend(), broadcast=True)
+        cache['a'] = 1
+        cache['b'] = 2
+        watcher = InvalidationWatcher(retry_interval=0.01)
+        watcher.start()
+        try:
+            CacheInvalidation.publish('test', ['a'])
+            CacheInvalidation.publish('test', ['b'])
+            deadline = time.time() + 5
+            while 'b' in cache and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertNotIn('b', cache)
+            self.assertTrue(watcher.is_alive())
+        finally:
+            watcher.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,8 +13,8 @@ class StringEnum(Enum):
     FIRST = 'FIRST'
     SECOND = 'SECOND'
 
-from mongoengine import Document, connect, connection
-from extras_mongoengine.fields import StringEnumField, IntEnumField
+from mongoengine import Document, ListField, connect, connection
+from extras_mongoengine.fields import StringEnumField, IntEnumField, LazyValue
 
 
 class EnumFieldTestCase(unittest.TestCase):
@@ -57,6 +57,80 @@ class EnumFieldTestCase(unittest.TestCase):
         self.assertTrue(doc.string_enum is StringEnum.SECOND)
         self.assertTrue(doc.int_enum is IntEnum.SECOND)
 
+    def test_lookup_tables(self):
+        field = self.document_class._fields['string_enum']
+        self.assertTrue(StringEnum.SECOND in field.choices)
+        self.assertFalse('SECOND' in field.choices)
+        self.assertFalse([] in field.choices)
+        self.assertTrue(field.to_python('SECOND') is StringEnum.SECOND)
+        self.assertEqual(field.prepare_query_value(None, StringEnum.SECOND), 'SECOND')
+        self.assertRaises(ValueError, field.to_python, 'THIRD')
+
+    def test_query_values(self):
+        field = self.document_class._fields['int_enum']
+        members = [IntEnum.SECOND, IntEnum.FIRST, IntEnum.SECOND]
+        self.assertEqual(field.query_values(members), [1, 2])
+        self.assertEqual(field.prepare_query_value('in', members), [1, 2])
+        self.assertEqual(field.prepare_query_value(None, members), [2, 1, 2])
+        self.assertEqual(
+            self.document_class.objects(
+                int_enum__in=field.query_values(members)).count(), 1)
+
+    def test_lazy_conversion(self):
+        class LazyDoc(Document):
+            string_enum = StringEnumField(StringEnum, lazy=True)
+            int_enum = IntEnumField(IntEnum, lazy=True)
+
+        LazyDoc(string_enum=StringEnum.SECOND, int_enum=IntEnum.SECOND).save()
+        doc = LazyDoc.objects.first()
+        self.assertTrue(isinstance(doc._data['string_enum'], LazyValue))
+        self.assertTrue(doc.string_enum is StringEnum.SECOND)
+        self.assertTrue(doc._data['string_enum'] is StringEnum.SECOND)
+
+        # Untouched lazy values are saved back unchanged.
+        doc.save()
+        doc = LazyDoc.objects.first()
+        self.assertTrue(doc.int_enum is IntEnum.SECOND)
+
+    def test_lazy_is_ignored_when_nested(self):
+        class NestedDoc(Document):
+            string_enums = ListField(StringEnumField(StringEnum, lazy=True))
+
+        NestedDoc(string_enums=[StringEnum.FIRST, StringEnum.SECOND]).save()
+        doc = NestedDoc.objects.first()
+        self.assertEqual(doc.string_enums, [StringEnum.FIRST, StringEnum.SECOND])
+
+    def test_compact_storage(self):
+        class CompactDoc(Document):
+            string_enum = StringEnumField(StringEnum, codes={
+                StringEnum.FIRST: 1, StringEnum.SECOND: 2})
+
+        CompactDoc._get_collection().insert({'string_enum': 'SECOND'})
+        CompactDoc(string_enum=StringEnum.FIRST).save()
+        raw = CompactDoc._get_collection().find_one({'string_enum': 1})
+        self.assertTrue(raw is not None)
+
+        # Legacy values are read and queried transparently until compacted.
+        self.assertEqual(
+            set(doc.string_enum for doc in CompactDoc.objects),
+            set([StringEnum.FIRST, StringEnum.SECOND]))
+        field = CompactDoc._fields['string_enum']
+        self.assertEqual(CompactDoc.objects(string_enum=StringEnum.SECOND).count(), 1)
+        self.assertEqual(field.query_values([StringEnum.SECOND]), [2, 'SECOND'])
+        self.assertEqual(CompactDoc.objects(
+            string_enum__in=field.query_values([StringEnum.SECOND])).count(), 1)
+        self.assertEqual(CompactDoc.objects(
+            string_enum__nin=field.query_values([StringEnum.SECOND])).count(), 1)
+        field = CompactDoc._fields['string_enum']
+        self.assertEqual(field.compact_collection(batch_size=1), 1)
+        self.assertEqual(CompactDoc.objects(string_enum=StringEnum.SECOND).count(), 1)
+
+    def test_compact_storage_requires_full_table(self):
+        self.assertRaises(ValueError, StringEnumField, StringEnum,
+                          codes={StringEnum.FIRST: 1})
+        self.assertRaises(ValueError, StringEnumField, StringEnum,
+                          codes={StringEnum.FIRST: 1, StringEnum.SECOND: 1})
+
 
 if __name__ == '__main__':
     unittest.main()
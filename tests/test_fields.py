@@ -2,11 +2,14 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
+import re
 from datetime import timedelta
 from mongoengine import Document, NotUniqueError, ValidationError, connect
 from mongoengine.connection import get_db
 
-from extras_mongoengine.fields import TimedeltaField, LowerStringField, LowerEmailField
+from mongoengine import StringField
+from extras_mongoengine.fields import TimedeltaField, LowerStringField, LowerEmailField, \
+    AutoSlugField, CachedSlugifier, LazyValue, SlugCounter
 
 
 class OldStyleTimedelta(timedelta):
@@ -29,6 +32,82 @@ class TimedeltaFieldTestCase(unittest.TestCase):
         value = OldStyleTimedelta(minutes=1, seconds=10)
         self.assertEqual(self.field.total_seconds(value), 70)
 
+    def test_storage_units(self):
+        field = TimedeltaField(unit='milliseconds')
+        value = timedelta(seconds=70, microseconds=1500)
+        self.assertEqual(field.to_mongo(value), 70001)
+        self.assertEqual(field.to_mongo(1500), 1500)
+        self.assertEqual(field.to_python(70001), timedelta(seconds=70, milliseconds=1))
+
+        field = TimedeltaField(unit='microseconds')
+        self.assertEqual(field.to_mongo(value), 70001500)
+        self.assertEqual(field.to_python(70001500), value)
+
+        self.assertRaises(ValueError, TimedeltaField, unit='hours')
+
+    def test_numbers_are_storage_units_on_every_path(self):
+        class Job(Document):
+            duration = TimedeltaField(unit='milliseconds')
+
+        field = Job._fields['duration']
+        job = Job(duration=5)
+        self.assertEqual(job.duration, timedelta(milliseconds=5))
+        self.assertEqual(job.to_mongo()['duration'], 5)
+        job.duration = 5
+        self.assertEqual(job.to_mongo()['duration'], 5)
+        self.assertEqual(field.prepare_query_value('gt', 5), 5)
+
+        # Timedeltas and numbers are both floored.
+        self.assertEqual(field.to_mongo(timedelta(microseconds=1999)), 1)
+        self.assertEqual(field.to_mongo(1.9999), 1)
+        self.assertEqual(field.to_mongo(field.to_python(1.9999)), 1)
+
+    def test_lazy_to_python(self):
+        class Job(Document):
+            duration = TimedeltaField(lazy=True)
+
+        field = Job._fields['duration']
+        value = field.to_python(70)
+        self.assertTrue(isinstance(value, LazyValue))
+        self.assertEqual(field.to_mongo(value), 70)
+        self.assertEqual(field.to_python(value), timedelta(seconds=70))
+
+        # Conversions are never deferred by a field that isn't bound to a
+        # document, nothing would unwrap the value.
+        self.assertEqual(TimedeltaField(lazy=True).to_python(70),
+                         timedelta(seconds=70))
+
+    def test_batch_conversion(self):
+        field = TimedeltaField(unit='milliseconds')
+        values = [timedelta(seconds=1), None, timedelta(minutes=1)]
+        stored = field.to_mongo_many(values)
+        self.assertEqual(stored, [1000, None, 60000])
+        self.assertEqual(field.to_python_many(stored), values)
+        self.assertEqual(field.to_seconds_many(stored), [1.0, None, 60.0])
+
+class CachedSlugifierTestCase(unittest.TestCase):
+
+    def test_cache_hits_and_eviction(self):
+        calls = []
+
+        def fake_slugify(value):
+            calls.append(value)
+            return value.lower()
+
+        slugifier = CachedSlugifier(fake_slugify, maxsize=2)
+        self.assertEqual(slugifier('A'), 'a')
+        self.assertEqual(slugifier('A'), 'a')
+        slugifier('B')
+        slugifier('C')  # evicts 'A'
+        slugifier('A')
+        self.assertEqual(calls, ['A', 'B', 'C', 'A'])
+        info = slugifier.cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['currsize']), (1, 4, 2))
+
+    def test_field_hook(self):
+        field = AutoSlugField(slugifier=lambda value: 'x')
+        self.assertEqual(field.slugify('anything'), 'x')
+
 class LowerStringFieldTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -48,6 +127,21 @@ class LowerStringFieldTestCase(unittest.TestCase):
         BlogPost.objects.create(slug='whatever')
         self.assertEqual(BlogPost.objects.get(slug='WHATEVER').slug, 'whatever')
 
+    def test_case_insensitive_operators_use_index_friendly_queries(self):
+        class User(Document):
+            username = LowerStringField()
+
+        User.objects.create(username='whatever')
+        qs = User.objects(username__iexact='WHATEVER')
+        self.assertEqual(qs._query, {'username': 'whatever'})
+        self.assertEqual(qs.count(), 1)
+
+        qs = User.objects(username__istartswith='WHAT')
+        regex = qs._query['username']
+        self.assertEqual(regex.pattern, '^what')
+        self.assertFalse(regex.flags & re.IGNORECASE)
+        self.assertEqual(qs.count(), 1)
+
     def test_case_insensitive_uniqueness(self):
         class User(Document):
             username = LowerStringField(unique=True)
@@ -66,6 +160,186 @@ class LowerStringFieldTestCase(unittest.TestCase):
         u2 = User(email='whatever')
         self.assertRaises(ValidationError, u2.save)
 
+    def test_lower_email_validation_cache(self):
+        field = LowerEmailField()
+        field.validate('test@example.com')
+        field.validate('test@example.com')
+        self.assertEqual(field.validation_cache.info()['hits'], 1)
+        self.assertRaises(ValidationError, field.validate, 'whatever')
+        self.assertRaises(ValidationError, field.validate, 'whatever')
+
+    def test_normalization_modes(self):
+        fullwidth = u'\uff26\uff55\uff4c\uff4c'
+        self.assertEqual(LowerStringField().normalize(u'ABC'), u'abc')
+        self.assertEqual(LowerStringField().normalize(fullwidth),
+                         u'\uff46\uff55\uff4c\uff4c')
+        field = LowerStringField(normalization='nfkc_casefold')
+        self.assertEqual(field.normalize(fullwidth), u'full')
+        self.assertEqual(field.normalize_many([u'A', u'b']), [u'a', u'b'])
+        # Byte strings, i.e. str on Python 2.
+        self.assertEqual(field.normalize(b'Full'), u'full')
+        self.assertEqual(field.normalize(u'\xc9t\xe9'.encode('utf-8')),
+                         u'\xe9t\xe9')
+        self.assertEqual(field.prepare_query_value('exact', b'ABC'), u'abc')
+        self.assertRaises(ValueError, LowerStringField, normalization='upper')
+
+
+class AutoSlugFieldTestCase(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='extrasmongoenginetest')
+        self.db = get_db()
+
+    def tearDown(self):
+        for collection in self.db.collection_names():
+            if 'system.' in collection:
+                continue
+            self.db.drop_collection(collection)
+
+    def _make_document(self, strategy):
+        class Article(Document):
+            title = StringField()
+            slug = AutoSlugField(populate_from='title', slug_strategy=strategy)
+        return Article
+
+    def test_strategies_allocate_suffixes(self):
+        for strategy in AutoSlugField.SLUG_STRATEGIES:
+            Article = self._make_document(strategy)
+            Article.drop_collection()
+            slugs = [Article.objects.create(title='Hello World').slug
+                     for _ in range(3)]
+            self.assertEqual(slugs, ['hello-world', 'hello-world-1', 'hello-world-2'])
+
+    def test_regex_strategy_picks_highest_suffix(self):
+        Article = self._make_document('regex')
+        Article.objects.create(title='Hello')
+        Article.objects.create(title='Hello 7')  # 'hello-7' is a suffix lookalike
+        self.assertEqual(Article.objects.create(title='Hello').slug, 'hello-8')
+
+    def test_counter_strategy_respects_existing_slugs(self):
+        Article = self._make_document('regex')
+        for _ in range(3):
+            Article.objects.create(title='Hello')
+        Article = self._make_document('counter')
+        self.assertEqual(Article.objects.create(title='Hello').slug, 'hello-3')
+        self.assertEqual(Article.objects.create(title='Hello').slug, 'hello-4')
+
+    def test_counter_strategy_skips_lookalike_slugs(self):
+        Article = self._make_document('counter')
+        self.assertEqual(Article.objects.create(title='Hello').slug, 'hello')
+        self.assertEqual(Article.objects.create(title='Hello 1').slug, 'hello-1')
+        self.assertEqual(Article.objects.create(title='Hello').slug, 'hello-2')
+
+        articles = [Article(title=title) for title in ('Hello 3', 'Hello')]
+        Article.objects.insert(AutoSlugField.assign_slugs(articles))
+        self.assertEqual([a.slug for a in articles], ['hello-3', 'hello-4'])
+
+    def test_counter_strategy_uses_the_document_alias(self):
+        connect(db='extrasmongoenginetest_other', alias='other')
+
+        class Article(Document):
+            title = StringField()
+            slug = AutoSlugField(populate_from='title', slug_strategy='counter')
+            meta = {'db_alias': 'other'}
+
+        other = get_db('other')
+        try:
+            self.assertEqual(Article.objects.create(title='Hello').slug, 'hello')
+            self.assertEqual(Article.objects.create(title='Hello').slug, 'hello-1')
+            self.assertIsNone(SlugCounter._get_collection().find_one())
+            self.assertIsNotNone(
+                other[SlugCounter._get_collection_name()].find_one())
+        finally:
+            other.client.drop_database(other.name)
+
+    def test_assign_slugs_batch(self):
+        Article = self._make_document('regex')
+        Article.objects.create(title='Hello')
+        articles = [Article(title=title)
+                    for title in ('Hello', 'Hello 1', 'Hello', 'Other')]
+        Article.objects.insert(AutoSlugField.assign_slugs(articles))
+        self.assertEqual([a.slug for a in articles],
+                         ['hello-2', 'hello-1', 'hello-3', 'other'])
+        self.assertEqual(Article.objects.count(), 5)
+
+    def test_assign_slugs_keeps_slugs_of_stored_documents(self):
+        class Article(Document):
+            title = StringField()
+            slug = AutoSlugField(populate_from='title', always_update=True)
+
+        article = Article.objects.create(title='Hello')
+        renamed = Article.objects.create(title='Other')
+        renamed.title = 'Hello'
+        new = Article(title='Hello')
+        AutoSlugField.assign_slugs([article, renamed, new])
+        self.assertEqual([a.slug for a in (article, renamed, new)],
+                         ['hello', 'hello-1', 'hello-2'])
+        renamed.save()
+        self.assertEqual(Article.objects.get(pk=renamed.pk).slug, 'hello-1')
+
+    def test_abstract_base_document(self):
+        class Base(Document):
+            title = StringField()
+            slug = AutoSlugField(populate_from='title')
+            meta = {'abstract': True}
+
+        class Page(Base):
+            pass
+
+        self.assertEqual(Page.objects.create(title='Hello').slug, 'hello')
+        self.assertEqual(Page.objects.create(title='Hello').slug, 'hello-1')
+
+    def test_slug_fields_are_registered_with_the_class(self):
+        class Article(Document):
+            title = StringField()
+            slug = AutoSlugField(populate_from='title')
+            meta = {'allow_inheritance': True}
+
+        class News(Article):
+            pass
+
+        for cls in (Article, News):
+            self.assertEqual([name for name, field in cls._auto_slug_fields],
+                             ['slug'])
+        self.assertEqual(News.objects.create(title='Hello').slug, 'hello')
+
+    def test_always_update_keeps_slug_of_unchanged_source(self):
+        class Article(Document):
+            title = StringField()
+            body = StringField()
+            slug = AutoSlugField(populate_from='title', always_update=True)
+
+        Article.objects.create(title='Hello')
+        article = Article.objects.create(title='Hello')
+        self.assertEqual(article.slug, 'hello-1')
+
+        article.body = 'text'
+        article.save()
+        self.assertEqual(article.slug, 'hello-1')
+
+        article.title = 'Hello!'
+        article.save()
+        self.assertEqual(article.slug, 'hello-1')
+
+        article.title = 'Bye'
+        article.save()
+        self.assertEqual(article.slug, 'bye')
+        self.assertEqual(Article.objects.get(pk=article.pk).slug, 'bye')
+
+    def test_new_document_with_explicit_pk(self):
+        class Page(Document):
+            id = StringField(primary_key=True)
+            title = StringField()
+            slug = AutoSlugField(populate_from='title', always_update=True)
+
+        page = Page(id='x', title='Hello')
+        page.save()
+        self.assertEqual(page.slug, 'hello')
+        self.assertEqual(Page.objects.get(pk='x').slug, 'hello')
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, AutoSlugField, slug_strategy='random')
+
 
 if __name__ == '__main__':
     unittest.main()